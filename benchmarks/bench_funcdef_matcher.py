@@ -0,0 +1,92 @@
+"""
+Compare the cost of selecting functions-with-docstrings via the generic
+fissix pattern matcher vs our hand-written `match_funcdef_docstring`.
+
+Usage:
+    python benchmarks/bench_funcdef_matcher.py [--max-files N] [--repeat R] [DIR]
+
+DIR defaults to the standard library of the running Python (parsed with
+the Python 3 grammar, files which fail to parse are skipped).
+"""
+# (the project imports have to follow the sys.path change below)
+# isort:skip_file
+import argparse
+import glob
+import os
+import sys
+import time
+
+from fissix import pygram, pytree
+from fissix.patcomp import PatternCompiler
+from fissix.pgen2 import driver
+from fissix.pygram import python_symbols as syms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from waterloo.refactor.annotations import (  # noqa: E402
+    FUNCDEF_DOCSTRING_PATTERN,
+    match_funcdef_docstring,
+)
+
+
+def load_funcdefs(dirname: str, max_files: int):
+    parser = driver.Driver(
+        pygram.python_grammar_no_print_statement, convert=pytree.convert
+    )
+    file_count = 0
+    funcdefs = []
+    for filename in sorted(glob.glob(os.path.join(dirname, "**/*.py"), recursive=True)):
+        if file_count >= max_files:
+            break
+        try:
+            with open(filename) as f:
+                source = f.read()
+            if not source.endswith("\n"):
+                source += "\n"
+            tree = parser.parse_string(source)
+        except Exception:
+            continue
+        file_count += 1
+        funcdefs.extend(node for node in tree.pre_order() if node.type == syms.funcdef)
+    return file_count, funcdefs
+
+
+def bench(match, funcdefs, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matched = sum(1 for node in funcdefs if match(node))
+        best = min(best, time.perf_counter() - start)
+    return best, matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dir", nargs="?", default=os.path.dirname(os.__file__))
+    parser.add_argument("--max-files", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    file_count, funcdefs = load_funcdefs(args.dir, args.max_files)
+    print(f"{len(funcdefs)} funcdefs from {file_count} files in {args.dir}")
+
+    pattern = PatternCompiler().compile_pattern(FUNCDEF_DOCSTRING_PATTERN)
+
+    def pattern_match(node):
+        results = {"node": node}
+        return pattern.match(node, results) and results
+
+    for name, match in (
+        ("pattern", pattern_match),
+        ("match_funcdef_docstring", match_funcdef_docstring),
+    ):
+        elapsed, matched = bench(match, funcdefs, args.repeat)
+        per_node = elapsed / len(funcdefs) * 1e6 if funcdefs else 0
+        print(
+            f"  {name:<24} {elapsed * 1000:8.2f} ms total, "
+            f"{per_node:6.2f} µs/funcdef ({matched} matched, best of {args.repeat})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Compare the per-file cost of the post-transform validation backends.
+
+Usage:
+    python benchmarks/bench_validation.py [--functions N] [--annotated N] [--repeat R]
+
+(results are printed to stderr, so stdout can be discarded)
+"""
+# (the project imports have to follow the sys.path change below)
+# isort:skip_file
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import inject
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from waterloo import configuration_factory  # noqa: E402
+from waterloo.conf.types import Settings  # noqa: E402
+from waterloo.refactor.annotations import _annotate_query  # noqa: E402
+from waterloo.refactor.base import WaterlooTool  # noqa: E402
+from waterloo.types import LogLevel, ValidationBackend  # noqa: E402
+
+FUNCTION_TEMPLATE = '''
+
+def function_{i}(arg1, arg2=None):
+    """
+    Does something.
+{sections}
+    """
+    result = dict(arg1)
+    for key in arg2 or []:
+        result[key] = len(key)
+    return bool(result)
+
+
+def helper_{i}(value):
+    """
+    Not annotated.
+    """
+    return [value for _ in range(3)]
+'''
+
+
+SECTIONS = """
+    Args:
+        arg1 (Dict[str, int]): blah
+        arg2 (Optional[List[str]]): blah
+
+    Returns:
+        bool: blah"""
+
+
+def make_module(functions: int, annotated: int) -> str:
+    """
+    Module of `functions` functions, spaced evenly through which `annotated`
+    have docstrings with types (so will be modified).
+    """
+    step = functions // annotated if annotated else functions + 1
+    parts = ['"""\nModule docstring\n"""\nimport logging\n']
+    parts.extend(
+        FUNCTION_TEMPLATE.format(
+            i=i, sections=SECTIONS if i % step == 0 and i // step < annotated else ""
+        )
+        for i in range(functions)
+    )
+    return "".join(parts)
+
+
+def bench(
+    filename: str, python_version: int, backend: ValidationBackend, repeat: int
+) -> float:
+    settings = Settings(
+        PYTHON_VERSION=f"{python_version}",
+        VERBOSE_ECHO=False,
+        LOG_LEVEL=LogLevel.DISABLED,
+    )
+    inject.clear_and_configure(configuration_factory(settings))
+
+    fixers = _annotate_query(python_version=python_version).compile()
+    options = {"print_function": True} if python_version == 3 else {}
+    tool = WaterlooTool(
+        fixers,
+        in_process=True,
+        interactive=False,
+        silent=True,
+        validation=backend.value,
+        options=options,
+    )
+
+    timings = []
+    validate = tool.validate
+
+    def timed_validate(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return validate(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    tool.validate = timed_validate  # type: ignore
+
+    for _ in range(repeat):
+        tool.refactor_file(filename)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--functions", type=int, default=200)
+    parser.add_argument("--annotated", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    source = make_module(args.functions, args.annotated)
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(source)
+    try:
+        results = [
+            (
+                python_version,
+                backend,
+                bench(f.name, python_version, backend, args.repeat),
+            )
+            for python_version in (2, 3)
+            for backend in ValidationBackend
+        ]
+    finally:
+        os.unlink(f.name)
+
+    print(
+        f"validating a {source.count(chr(10))}-line module with "
+        f"{args.functions} functions, {args.annotated} of them annotated "
+        f"(median of {args.repeat})",
+        file=sys.stderr,
+    )
+    for python_version, backend, elapsed in results:
+        print(
+            f"  py{python_version} {backend.name:<12} {elapsed * 1000:8.2f} ms/file",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
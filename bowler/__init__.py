@@ -10,9 +10,10 @@
 __author__ = "John Reese, Facebook"
 __version__ = "0.8.0"
 
+from .cache import ResultCache
 from .imr import FunctionArgument, FunctionSpec
 from .query import Query
-from .tool import BowlerTool
+from .tool import BowlerTool, LifecycleFixer
 from .types import (
     ARG_ELEMS,
     ARG_END,
@@ -26,11 +27,16 @@ from .types import (
     BowlerException,
     Callback,
     Capture,
+    EditRegion,
     Filename,
+    FilenameMatcher,
     Filter,
     Fixers,
+    FixersFactory,
     Hunk,
     IMRError,
+    Matcher,
     Processor,
+    SourceMatcher,
     Stringish,
 )
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from attr import dataclass
+
+from .types import Filename, Hunk
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedResult:
+    key: str
+    hunks: List[Hunk]
+    stats: Dict[str, int]
+
+
+class ResultCache:
+    """
+    On-disk cache of per-file refactoring results.
+
+    Entries are keyed by a hash of the file contents plus a `fingerprint` of
+    everything else which can affect the result (e.g. settings and tool
+    version), so a file whose contents are unchanged since the last run
+    with the same fingerprint does not need to be processed again.
+    """
+
+    FILENAME = "results.json"
+    DURATIONS_FILENAME = "durations.json"
+
+    def __init__(self, cache_dir: str, fingerprint: str) -> None:
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+        # how long each file took to process last time it was, in microseconds
+        # (kept regardless of the file contents, as a guide for scheduling)
+        self.durations_path = os.path.join(cache_dir, self.DURATIONS_FILENAME)
+        self.durations: Dict[str, int] = {}
+        self.durations_dirty = False
+
+    def _load(self, path: str) -> Dict[str, Any]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable cache {path}: {e}")
+            return {}
+
+    def load(self) -> None:
+        self.entries = self._load(self.path)
+        self.durations = self._load(self.durations_path)
+
+    def _save(self, path: str, data: Dict[str, Any]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write atomically, so that an interrupted run can't corrupt the cache
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def save(self) -> None:
+        if self.dirty:
+            self._save(self.path, self.entries)
+            self.dirty = False
+        if self.durations_dirty:
+            self._save(self.durations_path, self.durations)
+            self.durations_dirty = False
+
+    def key(self, data: bytes) -> str:
+        digest = hashlib.sha1(self.fingerprint.encode("utf-8"))
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, filename: Filename, key: str) -> Optional[CachedResult]:
+        entry = self.entries.get(os.path.abspath(filename))
+        if entry is None or entry["key"] != key:
+            return None
+        return CachedResult(**entry)
+
+    def set(
+        self, filename: Filename, key: str, hunks: List[Hunk], stats: Dict[str, int]
+    ) -> None:
+        self.entries[os.path.abspath(filename)] = {
+            "key": key,
+            "hunks": hunks,
+            "stats": stats,
+        }
+        self.dirty = True
+
+    def get_duration(self, filename: Filename) -> Optional[int]:
+        return self.durations.get(os.path.abspath(filename))
+
+    def set_duration(self, filename: Filename, duration: int) -> None:
+        self.durations[os.path.abspath(filename)] = duration
+        self.durations_dirty = True
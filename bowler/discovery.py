@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+import os
+import re
+from typing import Iterable, Iterator, List, Optional, Pattern, Sequence, Tuple
+
+from .types import Filename, FilenameMatcher
+
+log = logging.getLogger(__name__)
+
+GITIGNORE = ".gitignore"
+
+
+def glob_to_regex(glob: str) -> str:
+    """
+    Translate a single gitignore-style glob (without any leading `!` or
+    trailing `/`) to a regex matching paths relative to the glob's base.
+
+    As for .gitignore files, a glob containing a `/` is anchored to the
+    base directory, otherwise it may match at any depth. `*` and `?` do
+    not match across `/`, while `**` does.
+    """
+    anchored = "/" in glob
+    glob = glob.lstrip("/")
+    parts = []
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif glob.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif c == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif c == "?":
+            parts.append("[^/]")
+            i += 1
+        elif c == "[" and "]" in glob[i + 2 :]:
+            end = glob.index("]", i + 2)
+            chars = glob[i + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            parts.append(f"[{chars}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+            i += 1
+    prefix = "" if anchored else "(?:.*/)?"
+    return prefix + "".join(parts)
+
+
+class IgnoreRules:
+    """
+    An ordered set of gitignore-style patterns, such as the lines of a
+    .gitignore file, applying to paths under `base`.
+
+    Paths are given relative to the directory being walked, using `/`
+    separators, and `base` is also relative to that ("" if the same). For
+    rules from a directory above the one being walked, `lead` is instead
+    the path of the walked directory relative to theirs.
+    """
+
+    def __init__(self, base: str, patterns: Iterable[str], lead: str = "") -> None:
+        self.base = base
+        self.lead = lead
+        self.rules: List[Tuple[Pattern, bool, bool]] = []
+        for pattern in patterns:
+            pattern = pattern.rstrip("\n")
+            if not pattern.strip() or pattern.startswith("#"):
+                continue
+            if not pattern.endswith("\\ "):
+                pattern = pattern.rstrip()
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            elif pattern.startswith("\\"):
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            regex = re.compile(glob_to_regex(pattern), re.DOTALL)
+            self.rules.append((regex, negate, dir_only))
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    @classmethod
+    def from_file(cls, base: str, path: str, lead: str = "") -> Optional["IgnoreRules"]:
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                rules = cls(base, f, lead)
+        except OSError as e:
+            log.debug(f"Ignoring unreadable {path}: {e}")
+            return None
+        return rules or None
+
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """
+        Returns:
+            `True` if `path` is ignored, `False` if explicitly re-included by
+            a negated pattern, or `None` if no pattern applies to it.
+        """
+        if self.base:
+            if not path.startswith(self.base + "/"):
+                return None
+            path = path[len(self.base) + 1 :]
+        path = self.lead + path
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(path):
+                return not negate
+        return None
+
+
+def _git_root(path: str) -> Optional[str]:
+    path = os.path.abspath(path)
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _parent_gitignores(root: str) -> List[IgnoreRules]:
+    """
+    Rules from .gitignore files in the directories above `root`, up to the
+    root of the git repository containing it (if any).
+    """
+    top = _git_root(root)
+    if top is None:
+        return []
+    found = []
+    root = path = os.path.abspath(root)
+    while path != top:
+        path = os.path.dirname(path)
+        lead = os.path.relpath(root, path).replace(os.sep, "/") + "/"
+        rules = IgnoreRules.from_file("", os.path.join(path, GITIGNORE), lead)
+        if rules is not None:
+            found.append(rules)
+    # outermost first, so that nearer files take precedence
+    found.reverse()
+    return found
+
+
+def find_files(
+    root: str,
+    filename_matcher: FilenameMatcher,
+    exclude: Sequence[str] = (),
+    include: Sequence[str] = (),
+    gitignore: bool = False,
+) -> Iterator[Filename]:
+    """
+    Walk `root` with `os.scandir`, yielding the files for which
+    `filename_matcher` is true, in the same order as a sorted `os.walk`.
+
+    Files and directories starting with '.' are skipped, as is anything
+    matching one of the `exclude` globs or (when `gitignore` is set) the
+    patterns of any .gitignore file which applies to it. Excluded
+    directories are pruned without descending into them. When `include`
+    globs are given, only files matching one of them, or under a directory
+    matching one of them, are yielded.
+
+    Globs follow .gitignore syntax, and are relative to `root`.
+    """
+    exclude_rules = IgnoreRules("", exclude)
+    include_rules = IgnoreRules("", include)
+    base_ignores = _parent_gitignores(root) if gitignore else []
+
+    def ignored(path: str, is_dir: bool, ignores: List[IgnoreRules]) -> bool:
+        if exclude_rules and exclude_rules.match(path, is_dir):
+            return True
+        result = None
+        for rules in ignores:
+            matched = rules.match(path, is_dir)
+            if matched is not None:
+                result = matched
+        return bool(result)
+
+    def selected(path: str, is_dir: bool, parent_included: bool) -> bool:
+        # (as for excludes, a matching directory includes everything under it)
+        matched = include_rules.match(path, is_dir)
+        return parent_included if matched is None else matched
+
+    # (rel_dir, ignores, included) where `included` means the directory
+    # matched an include glob, or there are none
+    stack = [("", base_ignores, not include_rules)]
+    while stack:
+        rel_dir, ignores, included = stack.pop()
+        dir_path = os.path.join(root, rel_dir) if rel_dir else root
+        log.debug("Descending into %s", dir_path)
+        try:
+            with os.scandir(dir_path) as it:
+                entries = [entry for entry in it if not entry.name.startswith(".")]
+        except OSError as e:
+            log.debug("Skipping %s: %s", dir_path, e)
+            continue
+
+        if gitignore:
+            rules = IgnoreRules.from_file(rel_dir, os.path.join(dir_path, GITIGNORE))
+            if rules is not None:
+                ignores = ignores + [rules]
+
+        dirs = []
+        files = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                # as `os.walk`, don't follow symlinks to directories
+                if is_dir and entry.is_symlink():
+                    continue
+            except OSError:
+                is_dir = False
+            (dirs if is_dir else files).append(entry.name)
+
+        for name in sorted(files):
+            filename = Filename(os.path.join(dir_path, name))
+            if not filename_matcher(filename):
+                continue
+            path = f"{rel_dir}/{name}" if rel_dir else name
+            if ignored(path, False, ignores):
+                continue
+            if not selected(path, False, included):
+                continue
+            yield filename
+
+        subdirs = []
+        for name in sorted(dirs):
+            path = f"{rel_dir}/{name}" if rel_dir else name
+            if ignored(path, True, ignores):
+                log.debug("Pruning %s", os.path.join(dir_path, name))
+                continue
+            subdirs.append((path, ignores, selected(path, True, included)))
+        stack.extend(reversed(subdirs))
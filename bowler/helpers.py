@@ -6,11 +6,13 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
-from typing import List, Optional, Sequence, Union
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple, Union
 
 import click
+from fissix.patcomp import PatternCompiler
 from fissix.pgen2.token import tok_name
-from fissix.pytree import Leaf, Node, type_repr
+from fissix.pytree import BasePattern, Leaf, Node, type_repr
 
 from .types import LN, SYMBOL, TOKEN, Capture, Filename, FilenameMatcher
 
@@ -19,6 +21,18 @@ log = logging.getLogger(__name__)
 INDENT_STR = ".  "
 
 
+@lru_cache(maxsize=256)
+def compile_pattern(pattern: str) -> Tuple[BasePattern, LN]:
+    """
+    Compile a fixer PATTERN, as `BaseFix.compile_pattern()` does, but only
+    once per process for each distinct pattern string.
+
+    Compiled patterns hold no state between matches, so are safe to share
+    between fixer instances.
+    """
+    return PatternCompiler().compile_pattern(pattern, with_tree=True)
+
+
 def print_selector_pattern(
     node: LN, results: Capture = None, filename: Filename = None, first: bool = True,
 ):
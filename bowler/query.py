@@ -10,7 +10,7 @@ import logging
 import pathlib
 import re
 from functools import wraps
-from typing import Callable, List, Optional, Type, TypeVar, Union, cast
+from typing import Any, Callable, List, Optional, Tuple, Type, TypeVar, Union, cast
 
 from fissix.fixer_base import BaseFix
 from fissix.fixer_util import Attr, Comma, Dot, LParen, Name, Newline, RParen
@@ -18,6 +18,7 @@ from fissix.pytree import Leaf, Node, type_repr
 
 from .helpers import (
     Once,
+    compile_pattern,
     dotted_parts,
     find_first,
     find_last,
@@ -42,6 +43,7 @@ from .types import (
     Filename,
     FilenameMatcher,
     Hunk,
+    Matcher,
     Processor,
     Stringish,
     Transform,
@@ -82,7 +84,71 @@ def selector(pattern: str) -> Callable[[QM], QM]:
     return wrapper
 
 
+def fixer_class(
+    pattern: Optional[str],
+    bm_compat: bool,
+    accept_type: Optional[int],
+    matcher: Optional[Matcher],
+    fixer: Optional[Type[BaseFix]],
+    filters: Tuple[Callback, ...],
+    callbacks: Tuple[Callback, ...],
+    filename_filters: Tuple[FilenameMatcher, ...] = (),
+) -> Type[BaseFix]:
+    """
+    Generate the Fixer class for a compiled transform.
+
+    Classes are not cached, since the filters and callbacks are typically
+    new closures on each compile, but their compiled patterns are (see
+    `helpers.compile_pattern`).
+    """
+
+    class Fixer(BaseFix):
+        PATTERN = pattern  # type: ignore
+        BM_compatible = bm_compat
+        _accept_type = accept_type
+        filename_matches = True
+        context: Any = None
+
+        def start_tree(self, tree: Node, filename: str) -> None:
+            super().start_tree(tree, filename)
+            # filename filters only need evaluating once per file
+            self.filename_matches = all(f(Filename(filename)) for f in filename_filters)
+
+        def compile_pattern(self) -> None:
+            if self.PATTERN is not None:
+                self.pattern, self.pattern_tree = compile_pattern(self.PATTERN)
+
+        def match(self, node: LN) -> Any:
+            if not self.filename_matches:
+                return False
+            if matcher:
+                return matcher(node)
+            return super().match(node)
+
+        def transform(self, node: LN, capture: Capture) -> Optional[LN]:
+            filename = cast(Filename, self.filename)
+            if self.context is not None:
+                capture["context"] = self.context
+            returned_node = None
+            if not filters or all(f(node, capture, filename) for f in filters):
+                if fixer:
+                    returned_node = fixer().transform(node, capture)
+                for callback in callbacks:
+                    if returned_node and returned_node is not node:
+                        raise BowlerException(
+                            "Only the last fixer/callback may return "
+                            "a different node.  See "
+                            "https://pybowler.io/docs/api-modifiers"
+                        )
+                    returned_node = callback(node, capture, filename)
+            return returned_node
+
+    return Fixer
+
+
 class Query:
+    TOOL_CLASS: Type[BowlerTool] = BowlerTool
+
     def __init__(
         self,
         *paths: Union[str, List[str]],
@@ -412,22 +478,18 @@ class Query:
         if include:
             regex = re.compile(include)
 
-            def filter_filename_include(
-                node: LN, capture: Capture, filename: Filename
-            ) -> bool:
+            def filter_filename_include(filename: Filename) -> bool:
                 return regex.search(filename) is not None
 
-            self.current.filters.append(filter_filename_include)
+            self.current.filename_filters.append(filter_filename_include)
 
         if exclude:
             regex = re.compile(exclude)
 
-            def filter_filename_exclude(
-                node: LN, capture: Capture, filename: Filename
-            ) -> bool:
+            def filter_filename_exclude(filename: Filename) -> bool:
                 return regex.search(filename) is None
 
-            self.current.filters.append(filter_filename_exclude)
+            self.current.filename_filters.append(filter_filename_exclude)
 
         return self
 
@@ -897,6 +959,18 @@ class Query:
         self.transforms.append(Transform(fixer=fx))
         return self
 
+    def select_matcher(self, matcher: Matcher, node_type: int) -> "Query":
+        """
+        Select nodes with a hand-written `matcher` function rather than a
+        pattern. It will only be offered nodes of `node_type`, and should
+        return a Capture (as a pattern would) for those which match.
+
+        This is useful where a pattern would need to backtrack over several
+        wildcards for every candidate node.
+        """
+        self.transforms.append(Transform(matcher=matcher, node_type=node_type))
+        return self
+
     def filter(self, callback: Union[str, Callback]) -> "Query":
         if isinstance(callback, str):
             code = compile(callback, "<string>", "eval")
@@ -924,10 +998,18 @@ class Query:
         return self
 
     def create_fixer(self, transform):
+        accept_type = None
+        matcher = transform.matcher
         if transform.fixer:
             bm_compat = transform.fixer.BM_compatible
             pattern = transform.fixer.PATTERN
 
+        elif matcher:
+            bm_compat = False
+            pattern = None
+            accept_type = transform.node_type
+            log.debug(f"select {matcher} for node type {accept_type}")
+
         else:
             bm_compat = False
             log.debug(f"select {transform.selector}[{transform.kwargs}]")
@@ -942,33 +1024,24 @@ class Query:
 
             log.debug(f"generated pattern: {pattern}")
 
-        filters = transform.filters
-        callbacks = transform.callbacks
+        filters = tuple(transform.filters)
+        callbacks = tuple(transform.callbacks)
+        filename_filters = tuple(transform.filename_filters)
 
         log.debug(f"registered {len(filters)} filters: {filters}")
         log.debug(f"registered {len(callbacks)} callbacks: {callbacks}")
-
-        class Fixer(BaseFix):
-            PATTERN = pattern  # type: ignore
-            BM_compatible = bm_compat
-
-            def transform(self, node: LN, capture: Capture) -> Optional[LN]:
-                filename = cast(Filename, self.filename)
-                returned_node = None
-                if not filters or all(f(node, capture, filename) for f in filters):
-                    if transform.fixer:
-                        returned_node = transform.fixer().transform(node, capture)
-                    for callback in callbacks:
-                        if returned_node and returned_node is not node:
-                            raise BowlerException(
-                                "Only the last fixer/callback may return "
-                                "a different node.  See "
-                                "https://pybowler.io/docs/api-modifiers"
-                            )
-                        returned_node = callback(node, capture, filename)
-                return returned_node
-
-        return Fixer
+        log.debug(f"registered {len(filename_filters)} filename filters")
+
+        return fixer_class(
+            pattern,
+            bm_compat,
+            accept_type,
+            matcher,
+            transform.fixer,
+            filters,
+            callbacks,
+            filename_filters,
+        )
 
     def compile(self) -> List[Type[BaseFix]]:
         if not self.transforms:
@@ -981,6 +1054,27 @@ class Query:
 
         return fixers
 
+    def compile_filename_filter(self) -> Optional[FilenameMatcher]:
+        """
+        Combine the filename filters of every transform into one, which is
+        true for files that at least one transform could match.
+
+        This lets the tool skip files which can't match at all without
+        reading them. Files that only some transforms exclude are still
+        processed, with those transforms' fixers disabled for the file.
+
+        Returns:
+            `None` if every file could match
+        """
+        groups = [tuple(t.filename_filters) for t in self.transforms]
+        if not groups or not all(groups):
+            return None
+
+        def filename_filter(filename: Filename) -> bool:
+            return any(all(f(filename) for f in group) for group in groups)
+
+        return filename_filter
+
     def execute(self, **kwargs) -> "Query":
         fixers = self.compile()
         if self.processors:
@@ -995,9 +1089,10 @@ class Query:
             kwargs["hunk_processor"] = processor
 
         kwargs.setdefault("filename_matcher", self.filename_matcher)
+        kwargs.setdefault("filename_filter", self.compile_filename_filter())
         if self.python_version == 3:
             kwargs.setdefault("options", {})["print_function"] = True
-        tool = BowlerTool(fixers, **kwargs)
+        tool = self.TOOL_CLASS(fixers, **kwargs)
         self.retcode = tool.run(self.paths)
         self.exceptions = tool.exceptions
         return self
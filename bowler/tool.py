@@ -5,33 +5,64 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import ast
 import difflib
+import io
 import logging
 import multiprocessing
 import os
-import sys
+import stat
+import tempfile
+import threading
 import time
-from queue import Empty
-from typing import Any, Iterator, List, Optional, Sequence, Tuple
+import tokenize
+from collections import Counter
+from itertools import chain
+from queue import Empty, Full
+from typing import (
+    Any,
+    Counter as CounterT,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
 
 import click
 from fissix import pygram
+from fissix.fixer_base import BaseFix
+from fissix.pgen2.grammar import Grammar
 from fissix.pgen2.parse import ParseError
+from fissix.pytree import Node
 from fissix.refactor import RefactoringTool, _detect_future_features
 
 from moreorless.patch import PatchException, apply_single_file
 
+from .cache import CachedResult, ResultCache
+from .discovery import find_files
 from .helpers import filename_endswith
 from .types import (
+    LN,
     BadTransform,
     BowlerException,
     BowlerQuit,
+    Capture,
+    EditRegion,
     Filename,
     FilenameMatcher,
     Fixers,
+    FixersFactory,
     Hunk,
     Processor,
     RetryFile,
+    SourceMatcher,
+    WorkerInitializer,
 )
 
 PROMPT_HELP = {
@@ -45,6 +76,40 @@ PROMPT_HELP = {
 
 log = logging.getLogger(__name__)
 
+VALIDATION_BACKENDS = ("fissix", "ast", "incremental")
+SCHEDULE_POLICIES = ("discovery", "size", "history")
+
+# sent on the results queue by the workers, in a list per batch of files
+FileResult = Tuple[Filename, List[Hunk], Optional[Exception], Dict[str, int]]
+# sent on the results queue by each worker when it has finished
+WORKER_DONE = None
+# sent on the results queue by a worker which stopped early to be replaced
+# (see `max_files_per_worker` and `max_worker_rss`)
+WORKER_RETIRED = "worker-retired"
+# sent on the results queue by the discovery thread when it has finished
+DISCOVERY_DONE = "discovery-done"
+
+
+class WorkerBatch(NamedTuple):
+    """
+    Sent on the results queue by a worker as it starts on a batch of files,
+    so that if the worker dies before returning their results we know which
+    files were lost (and can release their memory estimates).
+    """
+
+    pid: int
+    filenames: List[Filename]
+
+
+class CachedFile(NamedTuple):
+    """
+    Sent on the results queue by the discovery thread for a file whose
+    result came from the cache.
+    """
+
+    filename: Filename
+    result: CachedResult
+
 
 def diff_texts(a: str, b: str, filename: str) -> Iterator[str]:
     lines_a = a.splitlines()
@@ -52,6 +117,149 @@ def diff_texts(a: str, b: str, filename: str) -> Iterator[str]:
     return difflib.unified_diff(lines_a, lines_b, filename, filename, lineterm="")
 
 
+def _format_range(start: int, stop: int) -> str:
+    # as per `difflib._format_range_unified`
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def map_edit_regions(
+    lines_a: List[str],
+    lines_b: List[str],
+    regions: List[EditRegion],
+    merge_within: int = 0,
+) -> Optional[List[List[int]]]:
+    """
+    Check that the lines of `a` outside of the edit `regions` are unchanged
+    (just offset) in `b`, and find where the regions ended up in `b`.
+
+    Args:
+        merge_within: regions separated by this many lines or fewer are
+            merged into one
+
+    Returns:
+        `[a_start, a_end, b_start, b_end]` for each (merged) region, or `None`
+        if `b` is not consistent with `regions`
+    """
+    windows: List[List[int]] = []
+    delta = 0
+    row = 0
+    for start, end, region_delta in sorted(regions):
+        if start < row or end < start:
+            return None
+        if lines_a[row:start] != lines_b[row + delta : start + delta]:
+            return None
+        if windows and start - windows[-1][1] <= merge_within:
+            windows[-1][1] = end
+            windows[-1][3] = end + delta + region_delta
+        else:
+            windows.append([start, end, start + delta, end + delta + region_delta])
+        delta += region_delta
+        row = end
+    if lines_a[row:] != lines_b[row + delta :]:
+        return None
+    return windows
+
+
+def diff_regions(
+    a: str, b: str, filename: str, regions: List[EditRegion], n: int = 3
+) -> Optional[List[str]]:
+    """
+    Equivalent of `diff_texts` for when the edits made to `a` are known, so
+    that only the edited regions (plus context) need to be diffed.
+
+    Returns `None` if `b` is not consistent with `regions`, i.e. some lines
+    outside of them have changed, in which case use `diff_texts` instead.
+    """
+    lines_a = a.splitlines()
+    lines_b = b.splitlines()
+    # regions are in terms of "\n"-terminated lines
+    for text, lines in ((a, lines_a), (b, lines_b)):
+        if len(lines) != text.count("\n") + (not text.endswith("\n")):
+            return None
+
+    windows = map_edit_regions(lines_a, lines_b, regions, merge_within=2 * n)
+    if windows is None:
+        return None
+
+    diff: List[str] = []
+    for a_start, a_end, b_start, b_end in windows:
+        # expand with context lines (which we know to be equal)
+        before = min(n, a_start)
+        after = min(n, len(lines_a) - a_end)
+        a_start, b_start = a_start - before, b_start - before
+        a_end, b_end = a_end + after, b_end + after
+
+        matcher = difflib.SequenceMatcher(
+            None, lines_a[a_start:a_end], lines_b[b_start:b_end]
+        )
+        for group in matcher.get_grouped_opcodes(n):
+            first, last = group[0], group[-1]
+            a_range = _format_range(a_start + first[1], a_start + last[2])
+            b_range = _format_range(b_start + first[3], b_start + last[4])
+            diff.append(f"@@ -{a_range} +{b_range} @@")
+            for tag, i1, i2, j1, j2 in group:
+                old = lines_a[a_start + i1 : a_start + i2]
+                new = lines_b[b_start + j1 : b_start + j2]
+                if tag == "equal":
+                    diff.extend(" " + line for line in old)
+                    continue
+                if tag in {"replace", "delete"}:
+                    diff.extend("-" + line for line in old)
+                if tag in {"replace", "insert"}:
+                    diff.extend("+" + line for line in new)
+
+    if not diff:
+        return []
+    return [f"--- {filename}", f"+++ {filename}", *diff]
+
+
+def changed_statements(
+    tree: Node, old_text: str, new_text: str, regions: List[EditRegion]
+) -> Optional[List[str]]:
+    """
+    Find the source of the top-level statements of `tree` (whose source is
+    `new_text`) touched by the edit `regions`, grouped into runs of adjacent
+    statements which can each be parsed on their own.
+
+    Returns:
+        `None` if this couldn't be determined
+    """
+    windows = map_edit_regions(old_text.split("\n"), new_text.split("\n"), regions)
+    if windows is None:
+        return None
+    # (widened by a line either side, in case a statement boundary was edited)
+    changed = [(b_start - 1, b_end + 1) for _, _, b_start, b_end in windows]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    row = 0
+    prev_text = "\n"
+    for child in tree.children:
+        text = str(child)
+        end = row + text.count("\n")
+        if any(start <= end and row < stop for start, stop in changed):
+            if not current and not prev_text.endswith("\n"):
+                # statement doesn't start at the beginning of a line
+                return None
+            current.append(text)
+        elif current and not current[-1].endswith("\n"):
+            current.append(text)
+        elif current:
+            chunks.append("".join(current))
+            current = []
+        row = end
+        prev_text = text
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
 def prompt_user(question: str, options: str, default: str = "") -> str:
     options = options.lower()
     default = default.lower()
@@ -80,9 +288,80 @@ def prompt_user(question: str, options: str, default: str = "") -> str:
             return default
 
 
+def current_rss() -> Optional[int]:
+    """
+    Resident set size of the current process in bytes, or `None` where we
+    can't tell (i.e. without /proc).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _worker_main(
+    tool_cls: Type["BowlerTool"],
+    fixers_factory: FixersFactory,
+    worker_initializer: Optional[WorkerInitializer],
+    tool_kwargs: Dict[str, Any],
+    queue: multiprocessing.JoinableQueue,
+    results: multiprocessing.Queue,
+    semaphore: Any,
+) -> None:
+    """
+    Entry point for worker processes.
+
+    Fixer classes generated by `Query.compile()` are closures and can't be
+    pickled, so instead of the parent's tool each worker builds its own from
+    picklable "recipes". This works for both the "fork" and "spawn" start
+    methods.
+
+    The worker's tool shares the parent's queues and semaphore, rather than
+    creating its own.
+    """
+    if worker_initializer is not None:
+        worker_initializer()
+    tool = tool_cls(fixers_factory(), in_process=True, in_worker=True, **tool_kwargs)
+    tool.queue = queue
+    tool.results = results
+    tool.semaphore = semaphore
+    tool.refactor_queue()
+
+
+class LifecycleFixer(BaseFix):
+    """
+    Base for fixers which don't match any nodes, and just want their
+    `start_tree` and `finish_tree` hooks called for each file.
+
+    `BowlerTool` calls these hooks itself, before and after all the other
+    fixers, and leaves these fixers out of the tree traversal so that they
+    aren't offered every node to (not) match.
+    """
+
+    PATTERN = None  # type: ignore
+    BM_compatible = False
+    context: Any = None
+
+    def match(self, node: LN) -> bool:
+        return False
+
+    def transform(self, node: LN, results: Capture) -> Optional[LN]:
+        return node
+
+
 class BowlerTool(RefactoringTool):
     NUM_PROCESSES = os.cpu_count() or 1
     IN_PROCESS = False  # set when run DEBUG mode from command line
+    LIVENESS_INTERVAL = 1.0  # seconds between checks for crashed workers
+    START_METHOD: Optional[str] = None  # multiprocessing default if None
+    QUEUE_MAXSIZE = 100  # batches discovered but not yet taken by a worker
+    BATCH_SIZE = 16  # max files sent to a worker at a time
+    BATCH_BYTES = 64 * 1024  # ...or fewer, once they total this size
+    # rough memory needed to process a file, per byte of source: fissix trees
+    # measured ~50-60x the source size, plus the new text and diff
+    MEMORY_PER_SOURCE_BYTE = 100
 
     def __init__(
         self,
@@ -92,85 +371,384 @@ class BowlerTool(RefactoringTool):
         write: bool = False,
         silent: bool = False,
         in_process: Optional[bool] = None,
+        in_worker: bool = False,
         hunk_processor: Processor = None,
         filename_matcher: Optional[FilenameMatcher] = None,
+        filename_filter: Optional[FilenameMatcher] = None,
+        exclude: Sequence[str] = (),
+        include: Sequence[str] = (),
+        gitignore: bool = False,
+        fixers_factory: Optional[FixersFactory] = None,
+        worker_initializer: Optional[WorkerInitializer] = None,
+        cache: Optional[ResultCache] = None,
+        source_matcher: Optional[SourceMatcher] = None,
+        direct_write: Optional[bool] = None,
+        validation: str = "fissix",
+        batch_size: Optional[int] = None,
+        batch_bytes: Optional[int] = None,
+        schedule: str = "discovery",
+        max_files_per_worker: Optional[int] = None,
+        max_worker_rss: Optional[int] = None,
+        memory_budget: Optional[int] = None,
         **kwargs,
     ) -> None:
         options = kwargs.pop("options", {})
         super().__init__(fixers, *args, options=options, **kwargs)
+        self.mp_context = multiprocessing.get_context(self.START_METHOD)
         self.queue_count = 0
-        self.queue = multiprocessing.JoinableQueue()  # type: ignore
-        self.results = multiprocessing.Queue()  # type: ignore
-        self.semaphore = multiprocessing.Semaphore(self.NUM_PROCESSES)
         self.interactive = interactive
         self.write = write
         self.silent = silent
+        # when changes are written without being shown, prompted or filtered
+        # we can write the new source straight to disk and skip the diffing
+        if direct_write is None:
+            direct_write = (
+                write and silent and not interactive and hunk_processor is None
+            )
+        self.direct_write = direct_write
+        if validation not in VALIDATION_BACKENDS:
+            raise ValueError(
+                f"validation must be one of {VALIDATION_BACKENDS}, not {validation!r}"
+            )
+        self.validation = validation
+        # files are sent to workers (and their results returned) in batches,
+        # to cut down on IPC for many small files
+        self.batch_size = max(1, batch_size or self.BATCH_SIZE)
+        self.batch_bytes = batch_bytes or self.BATCH_BYTES
+        self.batch: List[Filename] = []
+        self.batch_total = 0
+        # set by `discover`, for `batch_limit`
+        self.worker_count = 1
+        self.unbatched_count: Optional[int] = None
+        if schedule not in SCHEDULE_POLICIES:
+            raise ValueError(
+                f"schedule must be one of {SCHEDULE_POLICIES}, not {schedule!r}"
+            )
+        self.schedule = schedule
+        # workers which have processed this many files, or grown beyond this
+        # many bytes RSS, are replaced by a fresh process (checked between
+        # batches, so never with a file in flight)
+        # Replacements are started while the discovery thread is running, so
+        # forking them isn't safe (the thread may hold locks, e.g. of queue
+        # buffers or logging handlers). They are always spawned instead, so
+        # need the `fixers_factory` recipe, without which workers aren't
+        # replaced.
+        if fixers_factory is None and not in_worker:
+            max_files_per_worker = max_worker_rss = None
+        self.max_files_per_worker = max_files_per_worker
+        self.max_worker_rss = max_worker_rss
+        self.spawn_context = multiprocessing.get_context("spawn")
+        self.fixers_factory = fixers_factory
+        self.worker_initializer = worker_initializer
         if in_process is None:
             in_process = self.IN_PROCESS
-        # pick the most restrictive of flags; we can pickle fixers when
-        # using spawn.
-        if sys.platform == "win32" or sys.version_info > (3, 7):
+        # without a `fixers_factory` recipe, workers can only get our fixers
+        # by inheriting them from this process via fork
+        if fixers_factory is None and self.mp_context.get_start_method() != "fork":
             in_process = True
         self.in_process = in_process
+        # files are only given to the workers while the estimated memory
+        # needed for those not yet returned stays under `memory_budget` bytes
+        # (in-process, all the files are queued before any are processed)
+        self.memory_budget = None if in_process else memory_budget
+        self.memory_estimates: Dict[Filename, int] = {}
+        self.memory_in_flight = 0
+        self.memory_released = threading.Condition()
+        # in a worker process, these are the parent's (see `_worker_main`)
+        if not in_worker:
+            # (shared with spawned replacement workers, if any, which can't
+            # use those created for forking)
+            ipc_context = self.mp_context
+            if max_files_per_worker or max_worker_rss:
+                ipc_context = self.spawn_context
+            self.results = ipc_context.Queue()  # type: ignore
+            self.semaphore = ipc_context.Semaphore(self.NUM_PROCESSES)
+            # in-process, all the files are queued before any are processed,
+            # but otherwise discovery runs alongside the workers and is held
+            # up when they fall behind
+            self.queue = ipc_context.JoinableQueue(  # type: ignore
+                0 if in_process else self.QUEUE_MAXSIZE
+            )
+        self.stop_discovery = threading.Event()
+        self.context: Any = None
         self.exceptions: List[BowlerException] = []
+        self.cache = cache
+        self.source_matcher = source_matcher
+        self.cache_keys: Dict[Filename, str] = {}
+        # per-file stats, may be populated by subclasses during refactor_file
+        self.file_stats: Dict[str, int] = {}
+        # totals of the per-file stats, plus our own counts
+        self.run_stats: CounterT[str] = Counter()
         if hunk_processor is not None:
             self.hunk_processor = hunk_processor
         else:
             self.hunk_processor = lambda f, h: True
         self.filename_matcher = filename_matcher or filename_endswith(".py")
+        # files which none of the fixers could match, regardless of content
+        self.filename_filter = filename_filter
+        # glob patterns (.gitignore syntax) for directory traversal
+        self.exclude = exclude
+        self.include = include
+        self.gitignore = gitignore
 
     def log_error(self, msg: str, *args: Any, **kwds: Any) -> None:
         self.logger.error(msg, *args, **kwds)
 
     def get_fixers(self) -> Tuple[Fixers, Fixers]:
         fixers = [f(self.options, self.fixer_log) for f in self.fixers]
+        self.lifecycle_fixers = [f for f in fixers if isinstance(f, LifecycleFixer)]
+        fixers = [f for f in fixers if not isinstance(f, LifecycleFixer)]
         pre: Fixers = [f for f in fixers if f.order == "pre"]
         post: Fixers = [f for f in fixers if f.order == "post"]
         return pre, post
 
+    def edit_regions(self, filename: str) -> Optional[List[EditRegion]]:
+        """
+        Hook for subclasses whose fixers know which lines of the file they
+        have changed, allowing a faster diff of just those regions.
+
+        Returns:
+            `None` if not known
+        """
+        return None
+
+    def refactor_tree(self, tree: Node, name: str) -> bool:
+        for fixer in self.lifecycle_fixers:
+            fixer.start_tree(tree, name)
+
+        super().refactor_tree(tree, name)
+
+        for fixer in self.lifecycle_fixers:
+            fixer.finish_tree(tree, name)
+        return tree.was_changed
+
+    def _make_hunks(self, old_text: str, new_text: str, filename: str) -> List[Hunk]:
+        hunks: List[Hunk] = []
+        diff: Optional[List[str]] = None
+        regions = self.edit_regions(filename)
+        if regions is not None:
+            diff = diff_regions(old_text, new_text, filename, regions)
+            if diff is None:
+                self.log_debug(f"Edit regions inconsistent for {filename}")
+        if diff is None:
+            diff = list(diff_texts(old_text, new_text, filename))
+        if not diff:
+            return hunks
+        a, b, *lines = diff
+
+        hunk: Hunk = []
+        for line in lines:
+            if line.startswith("@@"):
+                if hunk:
+                    hunks.append([a, b, *hunk])
+                    hunk = []
+            hunk.append(line)
+
+        if hunk:
+            hunks.append([a, b, *hunk])
+
+        return hunks
+
     def processed_file(
-        self, new_text: str, filename: str, old_text: str = "", *args, **kwargs
+        self,
+        new_text: str,
+        filename: str,
+        old_text: str = "",
+        *args,
+        encoding: Optional[str] = None,
+        tree: Optional[Node] = None,
+        **kwargs,
     ) -> List[Hunk]:
         self.files.append(filename)
         hunks: List[Hunk] = []
         if old_text != new_text:
-            a, b, *lines = list(diff_texts(old_text, new_text, filename))
-
-            hunk: Hunk = []
-            for line in lines:
-                if line.startswith("@@"):
-                    if hunk:
-                        hunks.append([a, b, *hunk])
-                        hunk = []
-                hunk.append(line)
-
-            if hunk:
-                hunks.append([a, b, *hunk])
-
-            original_grammar = self.driver.grammar
-            if "print_function" in _detect_future_features(new_text):
-                self.driver.grammar = pygram.python_grammar_no_print_statement
+            # when writing directly we don't need a diff, unless it's to
+            # report a bad transform
+            if not self.direct_write:
+                hunks = self._make_hunks(old_text, new_text, filename)
+
             try:
-                new_tree = self.driver.parse_string(new_text)
-                if new_tree is None:
-                    raise AssertionError("Re-parsed CST is None")
+                self.validate(new_text, filename, old_text, tree)
             except Exception as e:
                 raise BadTransform(
                     f"Transforms generated invalid CST for {filename}",
                     filename=filename,
-                    hunks=hunks,
+                    hunks=hunks or self._make_hunks(old_text, new_text, filename),
                 ) from e
-            finally:
-                self.driver.grammar = original_grammar
+
+            if self.direct_write:
+                # (as an error, so the file isn't cached as having no changes)
+                if not self.write_file(new_text, filename, old_text, encoding):
+                    raise BowlerException(
+                        f"Failed to write {filename}", filename=filename
+                    )
+                self.file_stats["written_count"] = 1
 
         return hunks
 
+    def _parse(self, text: str, grammar: Grammar) -> None:
+        original_grammar = self.driver.grammar
+        self.driver.grammar = grammar
+        try:
+            new_tree = self.driver.parse_string(text)
+            if new_tree is None:
+                raise AssertionError("Re-parsed CST is None")
+        finally:
+            self.driver.grammar = original_grammar
+
+    def validate(
+        self,
+        new_text: str,
+        filename: str,
+        old_text: str = "",
+        tree: Optional[Node] = None,
+    ) -> None:
+        """
+        Check that the transformed source `new_text` is still valid, raising
+        an exception if not. How we check is set by `self.validation`:
+
+        - "fissix": re-parse the whole file with the (pure python) fissix
+          driver
+        - "ast": for Python 3 targets, parse with the (C) built-in parser,
+          otherwise as per "fissix"
+        - "incremental": if the edited regions are known (and `tree` is
+          given) re-parse only the top-level statements containing them,
+          otherwise as per "fissix"
+
+        Failures from the faster backends are always confirmed by a full
+        fissix parse, so they can't produce false positives.
+        """
+        grammar = self.driver.grammar
+        if "print_function" in _detect_future_features(new_text):
+            grammar = pygram.python_grammar_no_print_statement
+
+        if self.validation == "ast" and self.options["print_function"]:
+            try:
+                compile(new_text, filename, "exec", ast.PyCF_ONLY_AST, True)
+                return
+            except (SyntaxError, ValueError):
+                pass
+        elif self.validation == "incremental" and tree is not None:
+            regions = self.edit_regions(filename)
+            if regions is not None:
+                chunks = changed_statements(tree, old_text, new_text, regions)
+                if chunks is not None:
+                    try:
+                        for chunk in chunks:
+                            self._parse(chunk, grammar)
+                        return
+                    except Exception:
+                        pass
+
+        self._parse(new_text, grammar)
+
+    def write_file(
+        self,
+        new_text: str,
+        filename: str,
+        old_text: str,
+        encoding: Optional[str] = None,
+    ) -> bool:
+        """
+        As per `RefactoringTool.write_file` but writes to a temp file which
+        then replaces the original, so the file is never left half-written.
+
+        Symlinks are followed, so that the file they point to is replaced. A
+        file with other hard links is instead written in place, as replacing
+        it would break the links. NOTE: the replaced file keeps the original
+        permissions, but is owned by the current user.
+
+        Returns:
+            whether the file was written
+        """
+        path = os.path.realpath(filename)
+        try:
+            st = os.stat(path)
+        except OSError as err:
+            self.log_error("Can't create %s: %s", filename, err)
+            return False
+        if st.st_nlink > 1:
+            return self._write_in_place(new_text, filename, encoding)
+
+        dirname, basename = os.path.split(path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=f".{basename}.")
+        except OSError as err:
+            self.log_error("Can't create %s: %s", filename, err)
+            return False
+
+        try:
+            with io.open(fd, "w", encoding=encoding, newline="") as fp:
+                fp.write(new_text)
+            os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+            os.replace(tmp_path, path)
+        except OSError as err:
+            os.unlink(tmp_path)
+            self.log_error("Can't write %s: %s", filename, err)
+            return False
+        self.log_debug("Wrote changes to %s", filename)
+        self.wrote = True
+        return True
+
+    def _write_in_place(
+        self, new_text: str, filename: str, encoding: Optional[str] = None
+    ) -> bool:
+        try:
+            with io.open(filename, "w", encoding=encoding, newline="") as fp:
+                fp.write(new_text)
+        except OSError as err:
+            self.log_error("Can't write %s: %s", filename, err)
+            return False
+        self.log_debug("Wrote changes to %s", filename)
+        self.wrote = True
+        return True
+
+    def _read_python_source(self, filename: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        As per `RefactoringTool._read_python_source` but reads the file only
+        once, returning `(None, None)` if rejected by `self.source_matcher`.
+        """
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError as err:
+            self.log_error("Can't open %s: %s", filename, err)
+            return None, None
+
+        if self.source_matcher is not None and not self.source_matcher(data):
+            self.skipped_file(filename)
+            return None, None
+
+        encoding = tokenize.detect_encoding(io.BytesIO(data).readline)[0]
+        return data.decode(encoding), encoding
+
+    def skipped_file(self, filename: str) -> None:
+        """
+        Called for files rejected by `self.source_matcher` without being
+        parsed. Subclasses may override to report on them.
+        """
+        self.log_debug(f"Skipping {filename}: no match for source matcher")
+        self.file_stats["skipped_count"] = 1
+
+    def file_context(self, filename: str) -> Any:
+        """
+        Hook for subclasses to create an object holding their per-file state.
+
+        It is made available to every fixer as `fixer.context` (and to Query
+        filters and modifiers as `capture["context"]`) while the file is
+        processed, and to the tool as `self.context`.
+        """
+        return None
+
     def refactor_file(self, filename: str, *a, **k) -> List[Hunk]:
+        self.context = self.file_context(filename)
+        for fixer in chain(self.pre_order, self.post_order, self.lifecycle_fixers):
+            fixer.context = self.context
         try:
             hunks: List[Hunk] = []
             input, encoding = self._read_python_source(filename)
             if input is None:
-                # Reading the file failed.
+                # Reading the file failed, or it was skipped.
                 return hunks
         except (OSError, UnicodeDecodeError) as e:
             log.error(f"Skipping {filename}: failed to read because {e}")
@@ -181,7 +759,9 @@ class BowlerTool(RefactoringTool):
                 input += "\n"
             tree = self.refactor_string(input, filename)
             if tree:
-                hunks = self.processed_file(str(tree), filename, input)
+                hunks = self.processed_file(
+                    str(tree), filename, input, encoding=encoding, tree=tree
+                )
         except ParseError as e:
             log.exception("Skipping {filename}: failed to parse ({e})")
 
@@ -193,114 +773,555 @@ class BowlerTool(RefactoringTool):
         Python files are those for which `self.filename_matcher(filename)`
         returns true, to allow for custom extensions.
 
-        Files and subdirectories starting with '.' are skipped.
+        Files and subdirectories starting with '.' are skipped, as are those
+        matching the `self.exclude` globs (or `.gitignore` files, if enabled)
+        and files excluded by `self.filename_filter`. Excluded directories are
+        not descended into.
         """
-        for dirpath, dirnames, filenames in os.walk(dir_name):
-            self.log_debug("Descending into %s", dirpath)
-            dirnames.sort()
-            filenames.sort()
-            for name in filenames:
-                fullname = os.path.join(dirpath, name)
-                if not name.startswith(".") and self.filename_matcher(
-                    Filename(fullname)
-                ):
-                    self.queue_work(Filename(fullname))
-            # Modify dirnames in-place to remove subdirs with leading dots
-            dirnames[:] = [dn for dn in dirnames if not dn.startswith(".")]
+        for filename in self.iter_dir(dir_name):
+            self.queue_work(filename)
 
-    def refactor_queue(self) -> None:
+    def iter_dir(self, dir_name: str) -> Iterator[Filename]:
+        for filename in find_files(
+            dir_name,
+            self.filename_matcher,
+            exclude=self.exclude,
+            include=self.include,
+            gitignore=self.gitignore,
+        ):
+            if self.filename_selected(filename):
+                yield filename
+
+    def filename_selected(self, filename: Filename) -> bool:
+        if self.filename_filter is None or self.filename_filter(filename):
+            return True
+        self.log_debug("Skipping %s: excluded by filename", filename)
+        return False
+
+    def refactor_queue(self, recycle: bool = True) -> None:
+        """
+        Process batches of files from the queue until the end-of-stream
+        marker, or (if `recycle`) until this worker is due to be replaced.
+        """
         self.semaphore.acquire()
+        retired = False
+        try:
+            retired = self._consume_queue(recycle)
+        finally:
+            self.semaphore.release()
+            # let the parent know this worker is done (or should be replaced),
+            # so it doesn't have to poll for completion
+            self.results.put(WORKER_RETIRED if retired else WORKER_DONE)
+
+    def worker_exhausted(self, file_count: int) -> bool:
+        """
+        Whether a worker which has processed `file_count` files should stop
+        taking work, to be replaced by a fresh process.
+        """
+        # (always take at least one batch, so a fresh worker already over
+        # the RSS limit can't be replaced endlessly)
+        if not file_count:
+            return False
+        if self.max_files_per_worker and file_count >= self.max_files_per_worker:
+            self.log_debug("Retiring worker after %d files", file_count)
+            return True
+        if self.max_worker_rss:
+            rss = current_rss()
+            if rss is not None and rss > self.max_worker_rss:
+                self.log_debug("Retiring worker at %d bytes RSS", rss)
+                return True
+        return False
+
+    def _consume_queue(self, recycle: bool) -> bool:
+        """
+        Returns:
+            whether we stopped early (before the end-of-stream marker) for
+            the worker to be replaced
+        """
+        retries: List[Filename] = []
+        file_count = 0
+        retired = False
         while True:
-            filename = self.queue.get()
+            if recycle and self.worker_exhausted(file_count):
+                retired = True
+                break
 
-            if filename is None:
+            batch = self.queue.get()
+
+            if batch is None:
                 break
 
             try:
-                hunks = self.refactor_file(filename)
-                self.results.put((filename, hunks, None))
-
-            except RetryFile:
-                self.log_debug(f"Retrying {filename} later...")
-                self.queue.put(filename)
-            except BowlerException as e:
-                log.exception(f"Bowler exception during transform of {filename}: {e}")
-                self.results.put((filename, e.hunks, e))
-            except Exception as e:
-                log.exception(f"Skipping {filename}: failed to transform because {e}")
-                self.results.put((filename, [], e))
-
+                self.results.put(WorkerBatch(os.getpid(), batch))
+                results = [self._process_queued(f, retries) for f in batch]
+                self.results.put([result for result in results if result])
             finally:
                 self.queue.task_done()
-        self.semaphore.release()
+            file_count += len(batch)
+
+        # (putting these back on the queue could block, or land after the end
+        # of the stream, so each worker retries its own once the rest are done)
+        while retries:
+            filename = retries.pop(0)
+            self.results.put(WorkerBatch(os.getpid(), [filename]))
+            result = self._process_queued(filename, retries)
+            if result:
+                self.results.put([result])
+        return retired
+
+    def _process_queued(
+        self, filename: Filename, retries: List[Filename]
+    ) -> Optional[FileResult]:
+        self.file_stats = {}
+        start = time.perf_counter()
+        try:
+            return self._refactor_queued(filename, retries)
+        finally:
+            # (the returned result holds this same `file_stats` dict)
+            self.file_stats["duration_us"] = int((time.perf_counter() - start) * 1e6)
+
+    def _refactor_queued(
+        self, filename: Filename, retries: List[Filename]
+    ) -> Optional[FileResult]:
+        try:
+            hunks = self.refactor_file(filename)
+            return (filename, hunks, None, self.file_stats)
+
+        except RetryFile:
+            self.log_debug(f"Retrying {filename} later...")
+            retries.append(filename)
+        except BowlerException as e:
+            log.exception(f"Bowler exception during transform of {filename}: {e}")
+            return (filename, e.hunks, e, self.file_stats)
+        except Exception as e:
+            log.exception(f"Skipping {filename}: failed to transform because {e}")
+            return (filename, [], e, self.file_stats)
+        return None
+
+    def worker_kwargs(self) -> Dict[str, Any]:
+        """
+        Picklable kwargs needed to rebuild an equivalent tool in a worker.
+        """
+        return {
+            "options": self.options,
+            "source_matcher": self.source_matcher,
+            "direct_write": self.direct_write,
+            "validation": self.validation,
+            "max_files_per_worker": self.max_files_per_worker,
+            "max_worker_rss": self.max_worker_rss,
+        }
+
+    def start_worker(self, replacement: bool = False) -> multiprocessing.Process:
+        """
+        Args:
+            replacement: for a worker replacing a retired one, which is always
+                spawned (see `max_files_per_worker`)
+        """
+        context = self.spawn_context if replacement else self.mp_context
+        if self.fixers_factory is not None:
+            child = context.Process(
+                target=_worker_main,
+                args=(
+                    type(self),
+                    self.fixers_factory,
+                    self.worker_initializer,
+                    self.worker_kwargs(),
+                    self.queue,
+                    self.results,
+                    self.semaphore,
+                ),
+            )
+        else:
+            child = context.Process(target=self.refactor_queue)
+        child.start()
+        return child
+
+    def _cache_key(self, filename: Filename) -> Optional[str]:
+        assert self.cache is not None
+        try:
+            with open(filename, "rb") as f:
+                return self.cache.key(f.read())
+        except OSError:
+            # let refactor_file report the error
+            return None
 
     def queue_work(self, filename: Filename) -> None:
-        self.queue.put(filename)
-        self.queue_count += 1
+        """
+        Called from the discovery thread for each file to be processed.
+        """
+        if self.cache is not None:
+            key = self._cache_key(filename)
+            if key is not None:
+                cached = self.cache.get(filename, key)
+                if cached is not None:
+                    self.log_debug(f"results: using cached result for {filename}")
+                    # (handled on the main thread, with the workers' results)
+                    self.results.put(CachedFile(filename, cached))
+                    if self.unbatched_count is not None:
+                        self.unbatched_count -= 1
+                    return
+                self.cache_keys[filename] = key
+
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            size = 0
+        self.batch.append(filename)
+        self.batch_total += size
+        if self.memory_budget:
+            estimate = size * self.MEMORY_PER_SOURCE_BYTE
+            self.memory_estimates[filename] = (
+                self.memory_estimates.get(filename, 0) + estimate
+            )
+        if (
+            len(self.batch) >= self.batch_limit()
+            or self.batch_total >= self.batch_bytes
+        ):
+            self.flush_batch()
+
+    def batch_limit(self) -> int:
+        """
+        Number of files at which the pending batch is sent to the workers: at
+        most `batch_size`, but small enough to keep all the workers busy.
+
+        When we know how many files there are still to batch (i.e. with a
+        schedule other than "discovery") each batch is an equal share of
+        those between the workers, so batches get smaller towards the end of
+        the run and no worker is left with a long last batch. Otherwise the
+        batch size starts at one file and doubles with each batch, so that
+        the first files are spread over the workers even if there are only a
+        few of them.
+        """
+        if self.worker_count <= 1:
+            return self.batch_size
+        if self.unbatched_count is not None:
+            share = -(-self.unbatched_count // self.worker_count)
+        else:
+            share = 2 ** min(
+                self.run_stats["batch_count"], self.batch_size.bit_length()
+            )
+        return max(1, min(self.batch_size, share))
+
+    def flush_batch(self) -> None:
+        if not self.batch:
+            return
+        batch, self.batch, self.batch_total = self.batch, [], 0
+        if self.unbatched_count is not None:
+            self.unbatched_count -= len(batch)
+        if self._admit(batch) and self._put_work(batch):
+            self.queue_count += len(batch)
+            self.run_stats["batch_count"] += 1
+            self.run_stats["batched_file_count"] += len(batch)
+
+    def _admit(self, batch: List[Filename]) -> bool:
+        """
+        Wait until the estimated memory needed for `batch`, on top of that for
+        the files already given to the workers, fits within `memory_budget`.
+
+        Returns:
+            `False` if the run was stopped while waiting
+        """
+        if not self.memory_budget:
+            return True
+        estimate = sum(self.memory_estimates.get(f, 0) for f in batch)
+        with self.memory_released:
+            deferred = False
+            # (with nothing in flight we always admit, otherwise a file too
+            # big for the budget on its own would never be processed)
+            while (
+                self.memory_in_flight
+                and self.memory_in_flight + estimate > self.memory_budget
+            ):
+                if self.stop_discovery.is_set():
+                    return False
+                if not deferred:
+                    deferred = True
+                    self.run_stats["deferred_batch_count"] += 1
+                    self.log_debug(
+                        "Deferring %d files (~%d bytes), %d bytes in flight",
+                        len(batch),
+                        estimate,
+                        self.memory_in_flight,
+                    )
+                self.memory_released.wait(self.LIVENESS_INTERVAL)
+            self.memory_in_flight += estimate
+            if self.memory_in_flight > self.run_stats["peak_memory_estimate"]:
+                self.run_stats["peak_memory_estimate"] = self.memory_in_flight
+        return True
+
+    def _release(self, filename: Filename) -> None:
+        estimate = self.memory_estimates.pop(filename, None)
+        if estimate is None:
+            return
+        with self.memory_released:
+            self.memory_in_flight -= estimate
+            self.memory_released.notify()
+
+    def _put_work(self, item: Optional[List[Filename]]) -> bool:
+        # the queue is bounded, so may block until a worker takes something,
+        # but give up if the run has been stopped
+        while not self.stop_discovery.is_set():
+            try:
+                self.queue.put(item, timeout=self.LIVENESS_INTERVAL)
+            except Full:
+                continue
+            return True
+        return False
+
+    def report_cached_file(self, filename: Filename, stats: Dict[str, int]) -> None:
+        """
+        Hook for subclasses to report on a file whose result came from the
+        cache, since `refactor_file` won't be called for it.
+        """
+        pass
+
+    def cacheable_stats(self, stats: Dict[str, int]) -> Optional[Dict[str, int]]:
+        """
+        Hook for subclasses to choose the stats cached with a file's result,
+        which are replayed when the cached result is used.
+
+        Returns:
+            `None` if the result should not be cached, e.g. because the
+            file's stats record something that can't be replayed from them
+        """
+        return stats
+
+    def handle_result(
+        self,
+        filename: Filename,
+        hunks: List[Hunk],
+        exc: Optional[Exception],
+        stats: Dict[str, int],
+    ) -> None:
+        self._release(filename)
+        duration = stats.pop("duration_us", None)
+        if duration is not None and self.cache is not None:
+            self.cache.set_duration(filename, duration)
+        self.run_stats["file_count"] += 1
+        self.run_stats.update(stats)
+
+        if exc or stats.get("written_count"):
+            # (if written the file no longer matches its cache key)
+            self.cache_keys.pop(filename, None)
+        if exc:
+            self.log_error(f"{type(exc).__name__}: {exc}")
+            if exc.__cause__:
+                self.log_error(f"  {type(exc.__cause__).__name__}: {exc.__cause__}")
+            if isinstance(exc, BowlerException) and exc.hunks:
+                diff = "\n".join("\n".join(hunk) for hunk in exc.hunks)
+                self.log_error(f"Generated transform:\n{diff}")
+            self.exceptions.append(exc)
+        else:
+            if filename in self.cache_keys:
+                assert self.cache is not None
+                key = self.cache_keys.pop(filename)
+                cached_stats = self.cacheable_stats(stats)
+                if cached_stats is not None:
+                    self.cache.set(filename, key, hunks, cached_stats)
+            self.log_debug(f"results: got {len(hunks)} hunks for {filename}")
+            self.process_hunks(filename, hunks)
 
     def refactor(self, items: Sequence[str], *a, **k) -> None:
         """Refactor a list of files and directories."""
+        if self.cache is not None:
+            self.cache.load()
+        try:
+            self._refactor(items)
+        finally:
+            if self.cache is not None:
+                self.cache.save()
 
+    def iter_files(self, items: Sequence[str]) -> Iterator[Filename]:
         for dir_or_file in sorted(items):
             if os.path.isdir(dir_or_file):
-                self.refactor_dir(dir_or_file)
-            else:
-                self.queue_work(Filename(dir_or_file))
+                yield from self.iter_dir(dir_or_file)
+            elif self.filename_selected(Filename(dir_or_file)):
+                yield Filename(dir_or_file)
+
+    def expected_costs(self, filenames: List[Filename]) -> Dict[Filename, float]:
+        """
+        Relative cost of processing each file, according to `self.schedule`.
+
+        Under the "history" policy this is how long the file took on a
+        previous run, as recorded in the results cache. Files we have no
+        history for are estimated from their size, at the average rate of
+        those we do. Otherwise (or with no cache) it is just the file size.
+        """
+        sizes: Dict[Filename, float] = {}
+        for filename in filenames:
+            try:
+                sizes[filename] = os.path.getsize(filename)
+            except OSError:
+                sizes[filename] = 0
+        if self.schedule != "history" or self.cache is None:
+            return sizes
+
+        durations: Dict[Filename, float] = {}
+        for filename in filenames:
+            duration = self.cache.get_duration(filename)
+            if duration is not None:
+                durations[filename] = duration
+        known_size = sum(sizes[filename] for filename in durations)
+        rate = sum(durations.values()) / known_size if known_size else 1.0
+        return {
+            filename: durations.get(filename, sizes[filename] * rate)
+            for filename in filenames
+        }
+
+    def discover(self, items: Sequence[str], worker_count: int) -> None:
+        """
+        Producer stage: queue up the files to be processed, followed by an
+        end-of-stream marker for each of the `worker_count` workers.
 
+        With the default "discovery" schedule files are queued as they are
+        found. Otherwise they are all found first, then queued in order of
+        most expensive first, so that one large file found late doesn't keep
+        a single worker busy after the rest have finished.
+        """
+        self.worker_count = worker_count
+        self.unbatched_count = None
+        try:
+            files: Iterable[Filename] = self.iter_files(items)
+            if self.schedule != "discovery":
+                filenames = list(files)
+                costs = self.expected_costs(filenames)
+                files = sorted(filenames, key=lambda f: costs[f], reverse=True)
+                self.unbatched_count = len(filenames)
+            for filename in files:
+                if self.stop_discovery.is_set():
+                    break
+                self.queue_work(filename)
+        except Exception as e:
+            log.exception(f"File discovery failed: {e}")
+            self.results.put([(Filename("<discovery>"), [], e, {})])
+        finally:
+            self.flush_batch()
+            self.results.put(DISCOVERY_DONE)
+            for _ in range(worker_count):
+                self._put_work(None)
+
+    def _refactor(self, items: Sequence[str]) -> None:
         children: List[multiprocessing.Process] = []
+        discovery: Optional[threading.Thread] = None
+        self.stop_discovery.clear()
+        # (reported with the batch counts, since the byte limit may mean
+        # batches are smaller than `batch_size`)
+        self.run_stats["batch_size"] = self.batch_size
+        self.run_stats["batch_bytes"] = self.batch_bytes
         if self.in_process:
-            self.queue.put(None)
-            self.refactor_queue()
+            self.discover(items, 1)
+            # (we can't replace our own process)
+            self.refactor_queue(recycle=False)
         else:
-            child_count = max(1, min(self.NUM_PROCESSES, self.queue_count))
+            # when only given files, don't start more workers than needed
+            child_count = self.NUM_PROCESSES
+            if not any(os.path.isdir(item) for item in items):
+                child_count = max(1, min(child_count, len(items)))
             self.log_debug(f"starting {child_count} processes")
             for i in range(child_count):
-                child = multiprocessing.Process(target=self.refactor_queue)
-                child.start()
-                children.append(child)
-                self.queue.put(None)
+                children.append(self.start_worker())
+            discovery = threading.Thread(
+                target=self.discover,
+                args=(items, child_count),
+                name="bowler-discovery",
+                daemon=True,
+            )
+            discovery.start()
 
-        results_count = 0
+        worker_count = len(children) or 1
+        finished_count = 0
+        discovery_done = False
+        # pid of the worker processing each file whose result is outstanding
+        file_workers: Dict[Filename, int] = {}
+        crashed_pids: Set[int] = set()
 
-        while True:
+        while finished_count < worker_count or not discovery_done:
             try:
-                filename, hunks, exc = self.results.get_nowait()
-                results_count += 1
-
-                if exc:
-                    self.log_error(f"{type(exc).__name__}: {exc}")
-                    if exc.__cause__:
-                        self.log_error(
-                            f"  {type(exc.__cause__).__name__}: {exc.__cause__}"
-                        )
-                    if isinstance(exc, BowlerException) and exc.hunks:
-                        diff = "\n".join("\n".join(hunk) for hunk in exc.hunks)
-                        self.log_error(f"Generated transform:\n{diff}")
-                    self.exceptions.append(exc)
-                else:
-                    self.log_debug(f"results: got {len(hunks)} hunks for {filename}")
-                    self.process_hunks(filename, hunks)
-
+                result = self.results.get(timeout=self.LIVENESS_INTERVAL)
             except Empty:
-                if self.queue.empty() and results_count == self.queue_count:
-                    break
-
-                elif not self.in_process and not any(
+                # only reached if a worker died without signalling completion,
+                # or they are all busy
+                for child in children:
+                    if child.exitcode and child.pid not in crashed_pids:
+                        crashed_pids.add(child.pid)
+                        finished_count += 1
+                        lost = [
+                            f for f, pid in file_workers.items() if pid == child.pid
+                        ]
+                        self.worker_crashed(child, lost)
+                        for filename in lost:
+                            del file_workers[filename]
+                if not self.in_process and not any(
                     child.is_alive() for child in children
                 ):
                     self.log_debug(f"child processes stopped without consuming work")
                     break
+                continue
 
-                else:
-                    time.sleep(0.05)
+            if result is WORKER_DONE:
+                finished_count += 1
+                continue
+            if result == WORKER_RETIRED:
+                # the retired worker finished its last batch (and any retries)
+                # before stopping, and left its end-of-stream marker on the
+                # queue for the replacement
+                self.run_stats["recycled_count"] += 1
+                children.append(self.start_worker(replacement=True))
+                self.log_debug("replaced a retired worker")
+                continue
+            if result == DISCOVERY_DONE:
+                discovery_done = True
+                continue
+            if isinstance(result, WorkerBatch):
+                for filename in result.filenames:
+                    file_workers[filename] = result.pid
+                continue
 
+            try:
+                if isinstance(result, CachedFile):
+                    self.run_stats["cached_count"] += 1
+                    self.report_cached_file(result.filename, result.result.stats)
+                    self.handle_result(
+                        result.filename, result.result.hunks, None, result.result.stats,
+                    )
+                else:
+                    # results for a batch of files
+                    for file_result in result:
+                        file_workers.pop(file_result[0], None)
+                        self.handle_result(*file_result)
             except BowlerQuit:
+                self.stop_discovery.set()
                 for child in children:
                     child.terminate()
                 break
 
+        if discovery is not None:
+            self.stop_discovery.set()
+            discovery.join()
+        for child in children:
+            child.join()
+
         self.log_debug(f"all children stopped and all diff hunks processed")
 
+    def worker_crashed(
+        self, child: multiprocessing.Process, filenames: List[Filename]
+    ) -> None:
+        """
+        Called for a worker which died without signalling completion (e.g.
+        killed for running out of memory), with the files it was processing.
+
+        Their results are lost, so they are reported as failed, which also
+        releases their memory estimates so that discovery isn't held up
+        waiting for them.
+        """
+        self.log_error(f"Worker process {child.pid} exited with code {child.exitcode}")
+        for filename in filenames:
+            exc = BowlerException(
+                f"Failed to process {filename}: worker process exited with "
+                f"code {child.exitcode}"
+            )
+            self.handle_result(filename, [], exc, {})
+
     def process_hunks(self, filename: Filename, hunks: List[Hunk]) -> None:
         auto_yes = False
         result = ""
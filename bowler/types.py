@@ -5,7 +5,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Any, Callable, Dict, List, NewType, Optional, Type, Union
+from typing import Any, Callable, Dict, List, NewType, Optional, Tuple, Type, Union
 
 from attr import Factory, dataclass
 from fissix.fixer_base import BaseFix
@@ -43,11 +43,19 @@ LN = Union[Leaf, Node]
 Stringish = Union[str, object]
 Filename = NewType("Filename", str)
 FilenameMatcher = Callable[[Filename], bool]
+SourceMatcher = Callable[[bytes], Any]
 Capture = Dict[str, Any]
 Callback = Callable[[Node, Capture, Filename], Any]
 Filter = Callable[[Node, Capture, Filename], bool]
+# returns a Capture (including "node") if the node matches, else None
+Matcher = Callable[[LN], Optional[Capture]]
 Fixers = List[Type[BaseFix]]
+FixersFactory = Callable[[], Fixers]
+WorkerInitializer = Callable[[], None]
 Hunk = List[str]
+# (start, end, delta): lines [start:end] (0-indexed) of the original file
+# were replaced by `end - start + delta` lines
+EditRegion = Tuple[int, int, int]
 Processor = Callable[[Filename, Hunk], bool]
 
 
@@ -57,7 +65,10 @@ class Transform:
     kwargs: Dict[str, Any] = Factory(dict)
     filters: List[Filter] = Factory(list)
     callbacks: List[Callback] = Factory(list)
+    filename_filters: List[FilenameMatcher] = Factory(list)
     fixer: Optional[Type[BaseFix]] = None
+    matcher: Optional[Matcher] = None
+    node_type: Optional[int] = None
 
 
 class BowlerException(Exception):
@@ -7,6 +7,7 @@ from waterloo.parsers.napoleon import (
     arg_type,
     args_head,
     docstring_parser,
+    docstring_section_head,
     ignored_line,
     p_arg_list,
     p_returns_block,
@@ -236,6 +237,23 @@ def test_ignored_lines():
     )
 
 
+@pytest.mark.parametrize(
+    "example,expected",
+    [
+        ("Just a summary line.", False),
+        ("\n    Builds JSON blob.\n    The Args: don't start here.\n    ", False),
+        ("\n    Args:\n        key (str): blah\n    ", True),
+        ("\n\tKeyword Args:\n\t\tkey (str): blah\n", True),
+        ("\n    Returns:\n        str: blah\n    ", True),
+        ("\n    Yield:\n        str: blah\n    ", True),
+    ],
+)
+def test_docstring_section_head(example, expected):
+    assert bool(docstring_section_head(example)) is expected
+    if not expected:
+        assert not docstring_parser.parse(example).has_types
+
+
 def test_p_arg_list():
     example = """
         Kwargs:
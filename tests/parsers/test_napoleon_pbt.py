@@ -11,12 +11,14 @@ from waterloo.parsers.napoleon import (
     arg_type,
     args_head,
     docstring_parser,
+    docstring_section_head,
     dotted_var_path,
     ignored_line,
     p_arg_list,
     p_returns_block,
     rest_of_line,
     returns_head,
+    section_head_prescan,
     type_atom,
     var_name,
 )
@@ -288,3 +290,7 @@ def test_docstring_parser(docstring):
         _validate_returns_section(
             example, result.return_type, context["returns_section"].context,
         )
+
+    if result.has_types:
+        assert docstring_section_head(example)
+        assert section_head_prescan(example.encode("utf-8", "surrogatepass"))
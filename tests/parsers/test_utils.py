@@ -0,0 +1,42 @@
+import parsy
+import pytest
+
+from waterloo.parsers.utils import line_info, line_info_at
+from waterloo.types import SourcePos
+
+
+@pytest.mark.parametrize(
+    "stream",
+    [
+        "",
+        "\n",
+        "\n\n",
+        "single line",
+        "trailing newline\n",
+        "\nleading newline",
+        """
+    Args:
+        key (str): identifying a specific token bucket
+        num_tokens (int): blah
+
+    Returns:
+        bool: whether we got the requested tokens or not
+""",
+    ],
+)
+def test_line_info_at(stream):
+    for index in range(len(stream) + 1):
+        expected = parsy.line_info_at(stream, index)
+        result = line_info_at(stream, index)
+        assert isinstance(result, SourcePos)
+        assert result == expected
+
+
+def test_line_info_at_invalid_index():
+    with pytest.raises(ValueError):
+        line_info_at("abc", 4)
+
+
+def test_line_info():
+    parser = parsy.string("ab\nc") >> line_info
+    assert parser.parse("ab\nc") == SourcePos(1, 1)
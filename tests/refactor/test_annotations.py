@@ -1,12 +1,35 @@
+import multiprocessing
+import os
 import tempfile
+import threading
+import time
+from functools import partial
+from itertools import chain
 
 import inject
 import pytest
+from bowler import BowlerTool
+from bowler.cache import ResultCache
+from fissix import pygram, pytree
+from fissix.patcomp import PatternCompiler
+from fissix.pgen2.driver import Driver
+from fissix.pygram import python_symbols as syms
 
 from tests.utils import override_settings
-from waterloo import configuration_factory
-from waterloo.refactor.annotations import annotate
-from waterloo.types import ImportCollisionPolicy, UnpathedTypePolicy
+from waterloo import configuration_factory, configure_for_settings
+from waterloo.refactor import context
+from waterloo.refactor.annotations import (
+    FUNCDEF_DOCSTRING_PATTERN,
+    AddTypeImports,
+    EndFile,
+    StartFile,
+    _annotate_fixers,
+    annotate,
+    m_add_type_comment,
+    match_funcdef_docstring,
+)
+from waterloo.refactor.base import NonMatchingFixer, WaterlooQuery, WaterlooTool
+from waterloo.types import ImportCollisionPolicy, UnpathedTypePolicy, ValidationBackend
 
 
 @pytest.mark.parametrize("allow_untyped_args", [True, False])
@@ -1451,3 +1474,844 @@ class SomeClass:
             annotated = fr.read()
 
     assert annotated == expected
+
+
+IDENTITY_CONTENT = '''
+def identity(arg1):
+    """
+    Args:
+        arg1 (str): blah
+
+    Returns:
+        str: blah
+    """
+    return arg1
+'''
+
+IDENTITY_EXPECTED = '''
+def identity(arg1):
+    # type: (str) -> str
+    """
+    Args:
+        arg1: blah
+
+    Returns:
+        blah
+    """
+    return arg1
+'''
+
+
+def configure_test_settings(**kwargs):
+    """
+    Configure injection with the settings used by the tests below, plus any
+    overrides given in `kwargs`.
+    """
+    defaults = dict(
+        ALLOW_UNTYPED_ARGS=False,
+        REQUIRE_RETURN_TYPE=False,
+        IMPORT_COLLISION_POLICY=ImportCollisionPolicy.IMPORT,
+        UNPATHED_TYPE_POLICY=UnpathedTypePolicy.FAIL,
+    )
+    test_settings = override_settings(**{**defaults, **kwargs})
+    inject.clear_and_configure(configuration_factory(test_settings))
+    return test_settings
+
+
+def write_modules(dirname, count, content=IDENTITY_CONTENT):
+    filenames = [os.path.join(dirname, f"module_{i}.py") for i in range(count)]
+    for filename in filenames:
+        with open(filename, "w") as fw:
+            fw.write(content)
+    return filenames
+
+
+def read_file(filename):
+    with open(filename, "r") as fr:
+        return fr.read()
+
+
+def make_tool(test_settings, **kwargs):
+    """
+    A (Python 3) `WaterlooTool` which can also be run with worker processes,
+    as `annotate` would create, by default a silent dry run in-process.
+    """
+    defaults = dict(in_process=True, interactive=False, write=False, silent=True)
+    return WaterlooTool(
+        _annotate_fixers(python_version=3),
+        fixers_factory=partial(_annotate_fixers, 3),
+        worker_initializer=partial(configure_for_settings, test_settings),
+        **{**defaults, **kwargs},
+    )
+
+
+@pytest.mark.parametrize("queue_maxsize,batch_size", [(100, 16), (1, 1)])
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_multiprocess(start_method, queue_maxsize, batch_size, monkeypatch):
+    monkeypatch.setattr(BowlerTool, "START_METHOD", start_method)
+    # (with a small queue, discovery has to wait for the workers)
+    monkeypatch.setattr(BowlerTool, "QUEUE_MAXSIZE", queue_maxsize)
+    monkeypatch.setattr(BowlerTool, "BATCH_SIZE", batch_size)
+    monkeypatch.setattr(BowlerTool, "NUM_PROCESSES", 2)
+
+    configure_test_settings()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = write_modules(dirname, 6)
+
+        annotate(
+            dirname, in_process=False, interactive=False, write=True, silent=True,
+        )
+
+        for filename in filenames:
+            assert read_file(filename) == IDENTITY_EXPECTED
+
+
+@pytest.mark.parametrize(
+    "limits", [{"max_files_per_worker": 1}, {"max_worker_rss": 1}],
+)
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_worker_recycling(start_method, limits, monkeypatch):
+    monkeypatch.setattr(BowlerTool, "START_METHOD", start_method)
+    monkeypatch.setattr(BowlerTool, "NUM_PROCESSES", 2)
+
+    replacements = []
+    start_worker = BowlerTool.start_worker
+
+    def spy_start_worker(self, replacement=False):
+        child = start_worker(self, replacement)
+        if replacement:
+            replacements.append(child)
+        return child
+
+    monkeypatch.setattr(BowlerTool, "start_worker", spy_start_worker)
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = write_modules(dirname, 6)
+
+        tool = make_tool(
+            test_settings, in_process=False, write=True, batch_size=1, **limits
+        )
+        tool.run([dirname])
+
+        for filename in filenames:
+            assert read_file(filename).count("# type: (str) -> str") == 1
+
+    # every worker retires after its first file, and no file is lost or
+    # processed twice
+    assert tool.run_stats["file_count"] == 6
+    assert tool.run_stats["comment_count"] == 6
+    assert tool.run_stats["recycled_count"] == 6
+    # (not forked while the discovery thread is running)
+    spawn_process = multiprocessing.get_context("spawn").Process
+    assert len(replacements) == 6
+    assert all(isinstance(child, spawn_process) for child in replacements)
+
+
+def test_memory_budget(monkeypatch):
+    monkeypatch.setattr(BowlerTool, "NUM_PROCESSES", 2)
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_modules(dirname, 6)
+
+        # only one file at a time fits the budget
+        estimate = len(IDENTITY_CONTENT) * BowlerTool.MEMORY_PER_SOURCE_BYTE
+        tool = make_tool(
+            test_settings,
+            in_process=False,
+            batch_size=1,
+            memory_budget=estimate * 3 // 2,
+        )
+        tool.run([dirname])
+
+    assert tool.run_stats["file_count"] == 6
+    assert tool.run_stats["comment_count"] == 6
+    assert tool.run_stats["peak_memory_estimate"] == estimate
+    assert tool.run_stats["deferred_batch_count"] >= 1
+    assert tool.memory_in_flight == 0
+
+
+def test_memory_budget_worker_crash(monkeypatch):
+    monkeypatch.setattr(BowlerTool, "START_METHOD", "fork")
+    monkeypatch.setattr(BowlerTool, "NUM_PROCESSES", 2)
+    monkeypatch.setattr(BowlerTool, "LIVENESS_INTERVAL", 0.1)
+
+    refactor_file = WaterlooTool.refactor_file
+
+    # (as if killed for running out of memory)
+    def crashing_refactor_file(self, filename, *args, **kwargs):
+        if filename.endswith("module_2.py"):
+            os._exit(1)
+        return refactor_file(self, filename, *args, **kwargs)
+
+    monkeypatch.setattr(WaterlooTool, "refactor_file", crashing_refactor_file)
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_modules(dirname, 6)
+
+        # only one file at a time fits the budget, so the run would hang if
+        # the crashed worker's file was never released
+        estimate = len(IDENTITY_CONTENT) * BowlerTool.MEMORY_PER_SOURCE_BYTE
+        tool = make_tool(
+            test_settings,
+            in_process=False,
+            batch_size=1,
+            memory_budget=estimate * 3 // 2,
+        )
+        run = threading.Thread(target=tool.run, args=([dirname],), daemon=True)
+        run.start()
+        run.join(timeout=30)
+        assert not run.is_alive(), "run did not finish"
+
+    assert tool.run_stats["file_count"] == 6
+    assert tool.run_stats["comment_count"] == 5
+    (exc,) = tool.exceptions
+    assert "module_2.py" in str(exc)
+    assert "exited with code 1" in str(exc)
+    assert tool.memory_in_flight == 0
+
+
+@pytest.mark.parametrize(
+    "batch_size,batch_bytes,expected_batches",
+    [(16, 1024 * 1024, 1), (2, 1024 * 1024, 3), (16, 1, 5), (1, 1, 5)],
+)
+def test_batching(batch_size, batch_bytes, expected_batches):
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_modules(dirname, 5)
+
+        tool = make_tool(test_settings, batch_size=batch_size, batch_bytes=batch_bytes)
+        tool.run([dirname])
+
+    assert tool.run_stats["file_count"] == 5
+    assert tool.run_stats["comment_count"] == 5
+    assert tool.run_stats["batch_count"] == expected_batches
+    assert tool.run_stats["batched_file_count"] == 5
+    # (the effective limits are reported too)
+    assert tool.run_stats["batch_size"] == batch_size
+    assert tool.run_stats["batch_bytes"] == batch_bytes
+
+
+@pytest.mark.parametrize("schedule", ["discovery", "size"])
+def test_small_run_uses_all_workers(schedule, monkeypatch):
+    monkeypatch.setattr(BowlerTool, "START_METHOD", "fork")
+    monkeypatch.setattr(BowlerTool, "NUM_PROCESSES", 2)
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_modules(dirname, 6)
+        pids_file = os.path.join(dirname, "pids.txt")
+
+        refactor_file = WaterlooTool.refactor_file
+
+        # (slow enough that one worker can't take every batch)
+        def slow_refactor_file(self, filename, *args, **kwargs):
+            time.sleep(0.1)
+            with open(pids_file, "a") as fa:
+                fa.write(f"{os.getpid()}\n")
+            return refactor_file(self, filename, *args, **kwargs)
+
+        monkeypatch.setattr(WaterlooTool, "refactor_file", slow_refactor_file)
+
+        # far fewer files than the default batch size
+        tool = make_tool(test_settings, in_process=False, schedule=schedule)
+        tool.run([dirname])
+
+        pids = read_file(pids_file).split()
+
+    assert tool.run_stats["file_count"] == 6
+    assert len(pids) == 6
+    assert len(set(pids)) == 2
+    assert tool.run_stats["batch_count"] == 3
+
+
+@pytest.mark.parametrize(
+    "schedule,expected",
+    [
+        ("discovery", ["a.py", "b.py", "c.py", "d.py"]),
+        ("size", ["c.py", "a.py", "d.py", "b.py"]),
+        # no history for d.py, estimated from its size
+        ("history", ["b.py", "c.py", "d.py", "a.py"]),
+    ],
+)
+def test_schedule(schedule, expected, monkeypatch):
+    sizes = {"a.py": 300, "b.py": 100, "c.py": 400, "d.py": 200}
+    durations = {"a.py": 1000, "b.py": 9000, "c.py": 4000}
+
+    refactored = []
+    refactor_file = WaterlooTool.refactor_file
+
+    def spy_refactor_file(self, filename, *args, **kwargs):
+        refactored.append(os.path.basename(filename))
+        return refactor_file(self, filename, *args, **kwargs)
+
+    monkeypatch.setattr(WaterlooTool, "refactor_file", spy_refactor_file)
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        for name, size in sizes.items():
+            with open(os.path.join(dirname, name), "w") as fw:
+                fw.write("#" * (size - 1) + "\n")
+
+        cache = ResultCache(os.path.join(dirname, ".cache"), "fingerprint")
+        for name, duration in durations.items():
+            cache.set_duration(os.path.join(dirname, name), duration)
+        cache.save()
+
+        tool = make_tool(
+            test_settings,
+            cache=ResultCache(os.path.join(dirname, ".cache"), "fingerprint"),
+            schedule=schedule,
+        )
+        tool.run([dirname])
+
+        assert refactored == expected
+
+        # durations from this run are recorded for the next
+        cache.load()
+        assert set(cache.durations) == {os.path.join(dirname, name) for name in sizes}
+        assert "duration_us" not in tool.run_stats
+
+
+def test_cache_dir(monkeypatch):
+    with tempfile.TemporaryDirectory() as dirname:
+        cache_dir = os.path.join(dirname, ".cache")
+        src_dir = os.path.join(dirname, "src")
+        os.mkdir(src_dir)
+        (filename,) = write_modules(src_dir, 1)
+
+        configure_test_settings(CACHE_DIR=cache_dir)
+
+        # dry run populates the cache
+        annotate(
+            src_dir, in_process=True, interactive=False, write=False, silent=True,
+        )
+        assert os.path.exists(os.path.join(cache_dir, "results.json"))
+
+        def fail(*args, **kwargs):
+            raise AssertionError("file should not have been processed")
+
+        monkeypatch.setattr(WaterlooTool, "refactor_file", fail)
+
+        # second run applies the cached result without re-processing the file
+        annotate(
+            src_dir, in_process=True, interactive=False, write=True, silent=True,
+        )
+        assert read_file(filename) == IDENTITY_EXPECTED
+
+
+def test_cache_skips_files_with_errors():
+    # (an error, as the return type is required)
+    content = '''
+def identity(arg1):
+    """
+    Args:
+        arg1 (str): blah
+    """
+    return arg1
+'''
+
+    test_settings = configure_test_settings(
+        PYTHON_VERSION="3.8", REQUIRE_RETURN_TYPE=True
+    )
+
+    with tempfile.TemporaryDirectory() as dirname:
+        src_dir = os.path.join(dirname, "src")
+        os.mkdir(src_dir)
+        write_modules(src_dir, 1, content)
+        write_modules(dirname, 1)
+
+        for _ in range(2):
+            tool = make_tool(
+                test_settings,
+                cache=ResultCache(os.path.join(dirname, ".cache"), "fingerprint"),
+            )
+            tool.run([dirname])
+
+    # the file with an error is processed again, to report the error
+    assert tool.run_stats["file_count"] == 2
+    assert tool.run_stats["cached_count"] == 1
+    assert tool.run_stats["error_count"] == 1
+
+
+def test_skip_files_without_section_heads(monkeypatch):
+    content = '''
+def identity(arg1):
+    """
+    Just a description.
+    """
+    return arg1
+'''
+
+    configure_test_settings()
+
+    parsed = []
+    monkeypatch.setattr(
+        WaterlooTool, "refactor_string", lambda *args: parsed.append(args)
+    )
+
+    with tempfile.TemporaryDirectory() as dirname:
+        (filename,) = write_modules(dirname, 1, content)
+
+        annotate(
+            filename, in_process=True, interactive=False, write=True, silent=True,
+        )
+
+        assert not parsed
+        assert read_file(filename) == content
+
+
+def test_docstring_cache():
+    # the same docstring, twice
+    content = IDENTITY_CONTENT + IDENTITY_CONTENT.replace("identity", "identity2")
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_modules(dirname, 1, content)
+
+        tool = make_tool(test_settings)
+        tool.run([dirname])
+
+    assert tool.run_stats["comment_count"] == 2
+    assert tool.run_stats["docstring_cache_hits"] == 1
+    assert tool.run_stats["docstring_cache_misses"] == 1
+
+
+def test_docstring_cache_counts_not_cached():
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        write_modules(dirname, 1)
+
+        for _ in range(2):
+            tool = make_tool(
+                test_settings,
+                cache=ResultCache(os.path.join(dirname, ".cache"), "fingerprint"),
+            )
+            tool.run([dirname])
+
+    # the cached result is replayed, but no docstrings were parsed this time
+    assert tool.run_stats["cached_count"] == 1
+    assert tool.run_stats["comment_count"] == 1
+    assert "docstring_cache_hits" not in tool.run_stats
+    assert "docstring_cache_misses" not in tool.run_stats
+
+
+def test_direct_write(monkeypatch):
+    configure_test_settings()
+
+    diffed = []
+    monkeypatch.setattr(
+        WaterlooTool, "_make_hunks", lambda *args: diffed.append(args) or []
+    )
+
+    with tempfile.TemporaryDirectory() as dirname:
+        (filename,) = write_modules(dirname, 1)
+        os.chmod(filename, 0o640)
+
+        annotate(
+            filename, in_process=True, interactive=False, write=True, silent=True,
+        )
+
+        assert not diffed
+        assert read_file(filename) == IDENTITY_EXPECTED
+        assert os.stat(filename).st_mode & 0o777 == 0o640
+        assert os.listdir(dirname) == ["module_0.py"]
+
+
+@pytest.mark.parametrize("link", ["symlink", "hardlink"])
+def test_direct_write_links(link):
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        (filename,) = write_modules(dirname, 1)
+        link_name = os.path.join(dirname, "link.py")
+        if link == "symlink":
+            os.symlink(filename, link_name)
+        else:
+            os.link(filename, link_name)
+
+        tool = make_tool(test_settings, write=True)
+        tool.run([link_name])
+
+        assert tool.run_stats["written_count"] == 1
+        assert read_file(filename) == IDENTITY_EXPECTED
+        if link == "symlink":
+            assert os.readlink(link_name) == filename
+        else:
+            assert os.path.samefile(link_name, filename)
+
+
+def test_direct_write_failed(monkeypatch):
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(tempfile, "mkstemp", fail)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        (filename,) = write_modules(dirname, 1)
+
+        tool = make_tool(test_settings, write=True)
+        assert tool.run([filename]) == 1
+
+        assert read_file(filename) == IDENTITY_CONTENT
+
+    assert "written_count" not in tool.run_stats
+    assert len(tool.exceptions) == 1
+
+
+def test_targeted_diff(monkeypatch):
+    content = '''"""
+Module docstring
+"""
+import logging
+
+
+def identity(arg1):
+    """
+    Args:
+        arg1 (Dict[str, int]): blah
+
+    Returns:
+        Dict[str, int]: blah
+    """
+    return arg1
+
+
+def no_types(arg1):
+    """
+    Just a description.
+    """
+    return arg1
+
+
+def first(arg1):
+    """
+    Args:
+        arg1 (List[str]): blah
+
+    Returns:
+        str
+    """
+    return arg1[0]
+'''
+
+    expected = '''"""
+Module docstring
+"""
+import logging
+from typing import Dict, List
+
+
+def identity(arg1):
+    # type: (Dict[str, int]) -> Dict[str, int]
+    """
+    Args:
+        arg1: blah
+
+    Returns:
+        blah
+    """
+    return arg1
+
+
+def no_types(arg1):
+    """
+    Just a description.
+    """
+    return arg1
+
+
+def first(arg1):
+    # type: (List[str]) -> str
+    """
+    Args:
+        arg1: blah
+    """
+    return arg1[0]
+'''
+
+    configure_test_settings()
+
+    # the whole file should not need to be diffed
+    monkeypatch.setattr(
+        "bowler.tool.diff_texts", lambda *args: pytest.fail("diffed whole file")
+    )
+
+    with tempfile.TemporaryDirectory() as dirname:
+        (filename,) = write_modules(dirname, 1, content)
+
+        annotate(
+            filename,
+            in_process=True,
+            interactive=False,
+            write=True,
+            silent=True,
+            direct_write=False,
+        )
+
+        assert read_file(filename) == expected
+
+
+@pytest.mark.parametrize("python_version", ["2.7", "3.6"])
+@pytest.mark.parametrize("validation_backend", list(ValidationBackend))
+@pytest.mark.parametrize("break_transform", [False, True])
+def test_validation_backend(
+    python_version, validation_backend, break_transform, monkeypatch
+):
+    other = """
+
+def other(arg1):
+    return arg1
+"""
+    content = IDENTITY_CONTENT + other
+
+    if break_transform:
+        # output an unterminated docstring
+        monkeypatch.setattr(
+            "waterloo.refactor.annotations.remove_types",
+            lambda docstring, signature: docstring[:-3],
+        )
+
+    configure_test_settings(
+        PYTHON_VERSION=python_version, VALIDATION_BACKEND=validation_backend,
+    )
+
+    with tempfile.TemporaryDirectory() as dirname:
+        (filename,) = write_modules(dirname, 1, content)
+
+        annotate(
+            filename, in_process=True, interactive=False, write=True, silent=True,
+        )
+
+        annotated = read_file(filename)
+
+    if break_transform:
+        assert annotated == content
+    else:
+        assert annotated == IDENTITY_EXPECTED + other
+
+
+def test_lifecycle_fixers_not_traversed():
+    fixers = _annotate_fixers(python_version=2)
+    tool = WaterlooTool(fixers, in_process=True)
+
+    lifecycle_types = {type(fixer) for fixer in tool.lifecycle_fixers}
+    assert lifecycle_types == {StartFile, AddTypeImports, EndFile}
+    for fixer in chain(tool.pre_order, tool.post_order):
+        assert not isinstance(fixer, NonMatchingFixer)
+
+
+def test_compiled_patterns_cached():
+    # selector patterns are only compiled once per process
+    (fixer_a,) = WaterlooQuery().select_function("foo").compile()
+    (fixer_b,) = WaterlooQuery().select_function("foo").compile()
+    (fixer_c,) = WaterlooQuery().select_function("bar").compile()
+    assert fixer_a({}, []).pattern is fixer_b({}, []).pattern
+    assert fixer_a({}, []).pattern is not fixer_c({}, []).pattern
+
+
+def test_filename_filter(tmp_path, monkeypatch):
+    for name in ("a.py", "b.py"):
+        (tmp_path / name).write_text("def foo():\n    pass\n")
+
+    refactored = []
+    refactor_file = WaterlooTool.refactor_file
+
+    def spy_refactor_file(self, filename, *args, **kwargs):
+        refactored.append(os.path.basename(filename))
+        return refactor_file(self, filename, *args, **kwargs)
+
+    monkeypatch.setattr(WaterlooTool, "refactor_file", spy_refactor_file)
+
+    matched = []
+
+    def record(label):
+        def modifier(node, capture, filename):
+            matched.append((label, os.path.basename(filename)))
+
+        return modifier
+
+    def run(query):
+        refactored.clear()
+        matched.clear()
+        query.execute(in_process=True, interactive=False, write=False, silent=True)
+
+    # a file which can't match is never read
+    run(
+        WaterlooQuery(str(tmp_path))
+        .select_function("foo")
+        .is_filename(exclude="b.py")
+        .modify(record("foo"))
+    )
+    assert refactored == ["a.py"]
+    assert matched == [("foo", "a.py")]
+
+    # ...but one which only some transforms exclude still is
+    run(
+        WaterlooQuery(str(tmp_path))
+        .select_function("foo")
+        .is_filename(include="a.py")
+        .modify(record("filtered"))
+        .select_function("foo")
+        .modify(record("unfiltered"))
+    )
+    assert refactored == ["a.py", "b.py"]
+    assert sorted(matched) == [
+        ("filtered", "a.py"),
+        ("unfiltered", "a.py"),
+        ("unfiltered", "b.py"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        'def f():\n    """doc"""\n    return 1\n',
+        'def f(a, b=1, *args, **kwargs):\n    """doc"""\n',
+        'def f(a: int) -> str:\n    "doc"\n    return a\n',
+        '@decorator\ndef f(a):  # comment\n    # comment\n    """doc"""; pass\n',
+        'class C:\n    async def f(self):\n        """doc"""\n',
+        'def f(\n    a,\n    b,\n):\n    """doc"""\n',
+        "def f(): pass\n",
+        'def f(): "doc"\n',
+        "def f():\n    return 1\n",
+        "def f():\n    x = 'not a docstring'\n",
+    ],
+)
+def test_match_funcdef_docstring(content):
+    driver = Driver(pygram.python_grammar_no_print_statement, convert=pytree.convert)
+    tree = driver.parse_string(content)
+    pattern = PatternCompiler().compile_pattern(FUNCDEF_DOCSTRING_PATTERN)
+
+    for node in tree.pre_order():
+        if node.type != syms.funcdef:
+            continue
+        expected = {"node": node}
+        if not pattern.match(node, expected):
+            expected = None
+
+        result = match_funcdef_docstring(node)
+
+        if expected is None:
+            assert result is None
+        else:
+            assert result.keys() == expected.keys()
+            for key, val in expected.items():
+                if isinstance(val, list):
+                    assert len(result[key]) == len(val)
+                    assert all(a is b for a, b in zip(result[key], val))
+                else:
+                    assert result[key] is val
+
+
+def test_interleaved_file_contexts():
+    content_a = '''
+from foo import Bar
+
+def one(arg1):
+    """
+    Args:
+        arg1 (Bar): blah
+
+    Returns:
+        None
+    """
+
+def two(arg1):
+    """
+    Args:
+        arg1 (Bar): blah
+
+    Returns:
+        None
+    """
+'''
+    content_b = '''
+def three(arg1):
+    """
+    Args:
+        arg1 (int): blah
+    """
+'''
+
+    test_settings = override_settings(
+        PYTHON_VERSION="3.8", ALLOW_UNTYPED_ARGS=False, REQUIRE_RETURN_TYPE=True,
+    )
+    inject.clear_and_configure(configuration_factory(test_settings))
+
+    driver = Driver(pygram.python_grammar_no_print_statement, convert=pytree.convert)
+    tool = WaterlooTool([], in_process=True, interactive=False, silent=True)
+
+    contexts = {}
+    funcdefs = {}
+    for filename, content in [("a.py", content_a), ("b.py", content_b)]:
+        tree = driver.parse_string(content)
+        contexts[filename] = tool.file_context(filename)
+        contexts[filename].start_tree(tree)
+        funcdefs[filename] = [
+            node for node in tree.pre_order() if node.type == syms.funcdef
+        ]
+
+    # process the functions of both files alternately, on the same thread
+    for filename in ["a.py", "b.py", "a.py"]:
+        node = funcdefs[filename].pop(0)
+        capture = match_funcdef_docstring(node)
+        capture["context"] = contexts[filename]
+        m_add_type_comment(node, capture, filename)
+
+    assert contexts["a.py"].stats()["comment_count"] == 2
+    assert contexts["a.py"].stats()["error_count"] == 0
+    assert contexts["a.py"].strategy_to_names
+    assert contexts["b.py"].stats()["comment_count"] == 0
+    assert contexts["b.py"].stats()["error_count"] == 1
+    assert contexts["b.py"].strategy_to_names == {}
+
+
+def test_local_types_collected_lazily(monkeypatch):
+    untyped = '''
+def identity(arg1):
+    """
+    Just a description.
+
+    Args:
+        arg1: blah
+    """
+    return arg1
+'''
+    typed = IDENTITY_CONTENT + IDENTITY_CONTENT.replace("identity", "other")
+
+    collected = []
+    collect_local_types = context.collect_local_types
+
+    def spy_collect_local_types(tree):
+        collected.append(tree)
+        return collect_local_types(tree)
+
+    monkeypatch.setattr(context, "collect_local_types", spy_collect_local_types)
+
+    test_settings = configure_test_settings(PYTHON_VERSION="3.8")
+
+    with tempfile.TemporaryDirectory() as dirname:
+        for name, content in [("typed.py", typed), ("untyped.py", untyped)]:
+            with open(os.path.join(dirname, name), "w") as fw:
+                fw.write(content)
+
+        tool = make_tool(test_settings)
+        tool.run([dirname])
+
+    assert tool.run_stats["comment_count"] == 2
+    # only for typed.py, and only once
+    assert len(collected) == 1
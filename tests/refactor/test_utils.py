@@ -2,11 +2,20 @@ from collections import OrderedDict
 
 import inject
 import pytest
+from fissix.pgen2.parse import ParseError
+from fissix.pygram import python_symbols as syms
 
 from tests.utils import override_settings
 from waterloo import configuration_factory
 from waterloo.parsers.napoleon import docstring_parser
-from waterloo.refactor.utils import find_local_types, get_type_comment, remove_types
+from waterloo.refactor.utils import (
+    _parse_source,
+    collect_local_types,
+    find_local_types,
+    get_signature,
+    get_type_comment,
+    remove_types,
+)
 from waterloo.types import (
     ArgsSection,
     ArgTypes,
@@ -237,19 +246,6 @@ def test_find_local_types(python_version):
             "Union": "typing",
         },
         package_imports={"logging", "nott.so.serious"},
-        signatures={
-            34: ("static", ("cls", "self")),
-            39: ("clsmethod", ("self",)),
-            49: ("method", ("cls",)),
-            53: ("conditionally_defined_method", ("cls",)),
-            57: ("first", ("products", "getter")),
-            77: ("second", ("products", "getter")),
-            97: ("second_inner", ("product", "key", "default")),
-            118: ("third", ("product_ids", "user_id")),
-            133: ("fourth", ("product_id", "user_id")),
-            141: ("fifth", ("product_ids", "user_id")),
-            158: ("sixth", ("product_ids",)),
-        },
     )
 
     test_settings = override_settings(PYTHON_VERSION=python_version)
@@ -258,3 +254,75 @@ def test_find_local_types(python_version):
     result = find_local_types("tests/fixtures/napoleon.py")
 
     assert result == expected
+
+
+def test_collect_local_types_scopes_and_assignments():
+    source = """
+from typing import TypeVar
+
+A = B = TypeVar("B")
+check(C=type("C", (), {}))
+
+class Outer:
+    def method(self, arg):
+        def inner(first, second):
+            pass
+
+        class Inner:
+            pass
+
+    @staticmethod
+    def static(arg):
+        pass
+
+def function(arg):
+    pass
+"""
+    result = collect_local_types(_parse_source(source, "3.8"))
+
+    # `C=...` is a keyword argument rather than an assignment
+    assert result.type_defs == {"B", "Outer", "Inner"}
+
+
+def test_get_signature():
+    source = """
+class Outer:
+    def method(self, arg):
+        def inner(first, second):
+            pass
+
+    @staticmethod
+    def static(arg):
+        pass
+
+    @classmethod
+    def clsmethod(cls, arg):
+        pass
+
+def function(arg):
+    pass
+"""
+    tree = _parse_source(source, "3.8")
+    signatures = {
+        node.get_lineno(): get_signature(node)
+        for node in tree.pre_order()
+        if node.type == syms.funcdef
+    }
+
+    assert signatures == {
+        3: ("method", ("arg",)),
+        # (we treat any function nested in a class as a method)
+        4: ("inner", ("second",)),
+        8: ("static", ("arg",)),
+        12: ("clsmethod", ("arg",)),
+        15: ("function", ("arg",)),
+    }
+
+
+@pytest.mark.parametrize(
+    "source", ["if (n := 10) > 5:\n    pass\n", "def f(a, /, b):\n    pass\n"]
+)
+def test_parse_source_py38_syntax_unsupported(source):
+    # (not supported by the fissix grammar)
+    with pytest.raises(ParseError):
+        _parse_source(source, "3.8")
@@ -0,0 +1,163 @@
+import os
+
+import pytest
+from bowler.discovery import IgnoreRules, find_files
+from bowler.helpers import filename_endswith
+
+
+def make_tree(root, paths):
+    for path in paths:
+        full = root / path
+        if path.endswith("/"):
+            full.mkdir(parents=True, exist_ok=True)
+        else:
+            full.parent.mkdir(parents=True, exist_ok=True)
+            full.write_text("")
+
+
+def relative(root, filenames):
+    return [os.path.relpath(f, str(root)).replace(os.sep, "/") for f in filenames]
+
+
+def sorted_walk(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        filenames.sort()
+        yield dirpath, dirnames, filenames
+
+
+@pytest.mark.parametrize(
+    "pattern,path,is_dir,expected",
+    [
+        ("*.py", "a.py", False, True),
+        ("*.py", "pkg/sub/a.py", False, True),
+        ("*.py", "a.pyc", False, None),
+        ("build/", "build", True, True),
+        ("build/", "build", False, None),
+        ("build/", "pkg/build", True, True),
+        ("/build", "build", True, True),
+        ("/build", "pkg/build", True, None),
+        ("pkg/*.py", "pkg/a.py", False, True),
+        ("pkg/*.py", "pkg/sub/a.py", False, None),
+        ("pkg/**/*.py", "pkg/sub/deeper/a.py", False, True),
+        ("pkg/**/*.py", "pkg/a.py", False, True),
+        ("**/migrations", "app/migrations", True, True),
+        ("test_[ab].py", "test_a.py", False, True),
+        ("test_[!ab].py", "test_a.py", False, None),
+        ("test_?.py", "test_c.py", False, True),
+    ],
+)
+def test_ignore_rules_match(pattern, path, is_dir, expected):
+    assert IgnoreRules("", [pattern]).match(path, is_dir) is expected
+
+
+def test_ignore_rules_last_match_wins():
+    rules = IgnoreRules("", ["# comment", "", "*.py", "!keep.py"])
+    assert rules.match("drop.py", False) is True
+    assert rules.match("keep.py", False) is False
+
+
+def test_ignore_rules_base():
+    rules = IgnoreRules("pkg", ["/generated.py"])
+    assert rules.match("pkg/generated.py", False) is True
+    assert rules.match("generated.py", False) is None
+    assert rules.match("pkg/sub/generated.py", False) is None
+
+
+def test_find_files_order(tmp_path):
+    paths = ["b.py", "a.py", "z/a.py", "m/b.py", "m/a.py", "m/n/a.py", "c.txt"]
+    make_tree(tmp_path, paths)
+    expected = [
+        os.path.join(dirpath, name)
+        for dirpath, dirnames, filenames in sorted_walk(str(tmp_path))
+        for name in filenames
+        if name.endswith(".py")
+    ]
+    assert list(find_files(str(tmp_path), filename_endswith(".py"))) == expected
+
+
+def test_find_files_exclude_include(tmp_path):
+    make_tree(
+        tmp_path,
+        [
+            "a.py",
+            "test_a.py",
+            ".hidden/a.py",
+            "venv/lib/site.py",
+            "pkg/b.py",
+            "pkg/test_b.py",
+            "pkg/venv/c.py",
+        ],
+    )
+    found = find_files(
+        str(tmp_path), filename_endswith(".py"), exclude=["/venv/", "test_*"]
+    )
+    assert relative(tmp_path, found) == ["a.py", "pkg/b.py", "pkg/venv/c.py"]
+
+    found = find_files(
+        str(tmp_path), filename_endswith(".py"), exclude=["venv/"], include=["pkg/*"]
+    )
+    assert relative(tmp_path, found) == ["pkg/b.py", "pkg/test_b.py"]
+
+    found = find_files(
+        str(tmp_path), filename_endswith(".py"), exclude=["venv/"], include=["b.py"]
+    )
+    assert relative(tmp_path, found) == ["pkg/b.py"]
+
+
+@pytest.mark.parametrize("include", ["src/", "src", "/src", "src/**"])
+def test_find_files_include_dir(tmp_path, include):
+    make_tree(tmp_path, ["a.py", "src/b.py", "src/pkg/c.py", "other/src.py"])
+    found = find_files(str(tmp_path), filename_endswith(".py"), include=[include])
+    assert relative(tmp_path, found) == ["src/b.py", "src/pkg/c.py"]
+
+
+def test_find_files_include_dir_negated(tmp_path):
+    make_tree(tmp_path, ["src/b.py", "src/pkg/c.py", "src/pkg/sub/d.py"])
+    found = find_files(
+        str(tmp_path), filename_endswith(".py"), include=["src/", "!pkg/"]
+    )
+    assert relative(tmp_path, found) == ["src/b.py"]
+
+
+def test_find_files_prunes_excluded_dirs(tmp_path, monkeypatch):
+    make_tree(tmp_path, ["a.py", "node_modules/x/y.py", "pkg/b.py"])
+    scanned = []
+    scandir = os.scandir
+
+    def spy_scandir(path):
+        scanned.append(os.path.relpath(path, str(tmp_path)))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", spy_scandir)
+    found = find_files(str(tmp_path), filename_endswith(".py"), exclude=["node_*"])
+    assert relative(tmp_path, found) == ["a.py", "pkg/b.py"]
+    assert scanned == [".", "pkg"]
+
+
+def test_find_files_gitignore(tmp_path):
+    make_tree(
+        tmp_path,
+        [
+            ".git/",
+            "build/a.py",
+            "src/a.py",
+            "src/generated.py",
+            "src/pkg/generated.py",
+            "src/pkg/keep_generated.py",
+            "src/pkg/local.py",
+        ],
+    )
+    (tmp_path / ".gitignore").write_text("build/\ngenerated.py\n")
+    (tmp_path / "src" / "pkg" / ".gitignore").write_text("/local.py\n")
+
+    found = find_files(str(tmp_path), filename_endswith(".py"))
+    assert len(list(found)) == 6
+
+    found = find_files(str(tmp_path), filename_endswith(".py"), gitignore=True)
+    assert relative(tmp_path, found) == ["src/a.py", "src/pkg/keep_generated.py"]
+
+    # .gitignore files above the searched dir still apply
+    src = tmp_path / "src"
+    found = find_files(str(src), filename_endswith(".py"), gitignore=True)
+    assert relative(src, found) == ["a.py", "pkg/keep_generated.py"]
@@ -1,6 +1,6 @@
 import logging
 import sys
-from threading import local
+from functools import lru_cache
 
 import inject
 import structlog
@@ -10,6 +10,7 @@ from structlog.threadlocal import merge_threadlocal
 
 from waterloo.conf import _settings
 from waterloo.printer import StylePrinter
+from waterloo.types import TypeSignature
 
 
 def configuration_factory(settings):
@@ -24,6 +25,16 @@ def configuration_factory(settings):
         logger = structlog.get_logger("waterloo")
         return logger.bind()
 
+    def get_docstring_parser():
+        from waterloo.parsers.napoleon import docstring_parser
+
+        # parse results are immutable, so can be shared between files
+        @lru_cache(maxsize=settings.DOCSTRING_CACHE_SIZE)
+        def parse(docstring: str) -> TypeSignature:
+            return docstring_parser.parse(docstring)
+
+        return parse
+
     def configure(binder):
         binder.bind("settings", settings)
         binder.bind_to_constructor("log", get_logger)
@@ -34,11 +45,19 @@ def configuration_factory(settings):
                 verbose_echo=settings.VERBOSE_ECHO,
             ),
         )
-        # for use in bowler subprocesses
-        # for passing data between individual steps processing same source file
-        binder.bind_to_constructor("threadlocals", local)
+        binder.bind_to_constructor("docstring_parser", get_docstring_parser)
 
     return configure
 
 
+def configure_for_settings(settings) -> None:
+    """
+    (Re)configure dependency injection for `settings`.
+
+    This is a module-level function so that `partial(configure_for_settings,
+    settings)` can be pickled and sent to bowler worker processes.
+    """
+    inject.clear_and_configure(configuration_factory(settings))
+
+
 inject.configure(configuration_factory(_settings))
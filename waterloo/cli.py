@@ -5,7 +5,13 @@ import inject
 from waterloo import configuration_factory
 from waterloo.__about__ import __version__
 from waterloo.refactor import annotate
-from waterloo.types import ImportCollisionPolicy, LogLevel, UnpathedTypePolicy
+from waterloo.types import (
+    ImportCollisionPolicy,
+    LogLevel,
+    SchedulePolicy,
+    UnpathedTypePolicy,
+    ValidationBackend,
+)
 
 
 @inject.params(settings="settings")
@@ -50,8 +56,7 @@ def main(settings):
         "to use (to know if `print` is a statement or a function). In Py2 "
         "mode, `print` will be auto-detected based on whether a `from "
         "__future__ import print_function` is found. For Py3 files `print` "
-        "can only be a function. We also use `parso` library which can "
-        "benefit from knowing <major>.<minor> version of your sources.",
+        "can only be a function.",
     )
     annotation_group.add_argument(
         "-aa",
@@ -128,6 +133,133 @@ def main(settings):
         help="Whether to prompt about applying each diff hunk.",
     )
 
+    discovery_group = annotate_cmd.add_argument_group("file discovery options")
+    discovery_group.add_argument(
+        "-ex",
+        "--exclude",
+        metavar="GLOB",
+        action="append",
+        default=settings.EXCLUDE,
+        help="Skip files and directories matching this glob when searching "
+        "dir paths (in .gitignore syntax, relative to the dir path). Excluded "
+        "directories are not searched at all. May be given multiple times.",
+    )
+    discovery_group.add_argument(
+        "-in",
+        "--include",
+        metavar="GLOB",
+        action="append",
+        default=settings.INCLUDE,
+        help="Only process files matching this glob, or in a directory matching "
+        "it, when searching dir paths (in .gitignore syntax, relative to the "
+        "dir path). May be given multiple times.",
+    )
+    discovery_group.add_argument(
+        "-gi",
+        "--gitignore",
+        action="store_true",
+        default=settings.USE_GITIGNORE,
+        help="Also skip files and directories ignored by .gitignore files "
+        "when searching dir paths.",
+    )
+
+    performance_group = annotate_cmd.add_argument_group("performance options")
+    performance_group.add_argument(
+        "-c",
+        "--cache-dir",
+        type=str,
+        default=settings.CACHE_DIR,
+        help="Directory in which to store results between runs. When set, "
+        "files whose contents (and waterloo settings) are unchanged since a "
+        "previous run will not be processed again, their cached result is "
+        "used instead.",
+    )
+
+    performance_group.add_argument(
+        "-dc",
+        "--docstring-cache-size",
+        type=int,
+        default=settings.DOCSTRING_CACHE_SIZE,
+        help="Max number of parsed docstrings to keep in memory (per worker "
+        "process). Identical docstrings are only parsed once.",
+    )
+
+    performance_group.add_argument(
+        "-vb",
+        "--validation-backend",
+        default=settings.VALIDATION_BACKEND.name,
+        choices=[m.name for m in ValidationBackend],
+        help="How we check that the annotated files are still valid Python. "
+        "FISSIX re-parses the whole file with the same (slow, pure Python) "
+        "parser used to read it. AST uses Python's built-in parser, but only "
+        "for Python 3 files (otherwise as FISSIX). INCREMENTAL re-parses "
+        "just the modified top-level statements. If either of the faster "
+        "options finds an error it is confirmed with a full re-parse.",
+    )
+
+    performance_group.add_argument(
+        "-bs",
+        "--batch-size",
+        type=int,
+        default=settings.BATCH_SIZE,
+        help="Max number of files to send to a worker process at a time "
+        "(fewer if they reach --batch-kib in size). Larger batches mean "
+        "less inter-process communication overhead when there are many small "
+        "files. Smaller batches are sent when needed to keep every worker "
+        "busy, e.g. at the start and end of a run.",
+    )
+
+    performance_group.add_argument(
+        "-bk",
+        "--batch-kib",
+        type=int,
+        default=settings.BATCH_KIB,
+        help="Total size in KiB of source files at which a batch is sent to a "
+        "worker process, even if it has fewer than --batch-size files.",
+    )
+
+    performance_group.add_argument(
+        "-sp",
+        "--schedule",
+        default=settings.SCHEDULE.name,
+        choices=[m.name for m in SchedulePolicy],
+        help="Order in which files are given to the worker processes. "
+        "DISCOVERY starts work on files as soon as they are found. SIZE and "
+        "HISTORY find all the files first, then start with the largest, or "
+        "with those which were slowest last time (needs --cache-dir, "
+        "otherwise as SIZE), so that a large file found last doesn't hold up "
+        "the end of the run.",
+    )
+
+    performance_group.add_argument(
+        "-mf",
+        "--max-files-per-worker",
+        type=int,
+        default=settings.MAX_FILES_PER_WORKER,
+        help="Replace each worker process with a fresh one after it has "
+        "processed this many files, to limit memory growth over long runs.",
+    )
+
+    performance_group.add_argument(
+        "-mr",
+        "--max-worker-rss",
+        type=int,
+        default=settings.MAX_WORKER_RSS,
+        help="Replace a worker process with a fresh one once its resident "
+        "memory exceeds this many MiB (checked after each batch of files, "
+        "needs /proc i.e. Linux).",
+    )
+
+    performance_group.add_argument(
+        "-mb",
+        "--memory-budget",
+        type=int,
+        default=settings.MEMORY_BUDGET,
+        help="Only give files to the worker processes while the memory needed "
+        "for those in progress, estimated from their size, stays under this "
+        "many MiB. Useful if you have some very large source files.",
+    )
+
     logging_group = annotate_cmd.add_argument_group("logging options")
     logging_group.add_argument(
         "-l",
@@ -173,6 +305,20 @@ def main(settings):
         settings.IMPORT_COLLISION_POLICY = args.import_collision_policy
         settings.UNPATHED_TYPE_POLICY = args.unpathed_type_policy
 
+        settings.EXCLUDE = args.exclude
+        settings.INCLUDE = args.include
+        settings.USE_GITIGNORE = args.gitignore
+
+        settings.CACHE_DIR = args.cache_dir
+        settings.DOCSTRING_CACHE_SIZE = args.docstring_cache_size
+        settings.VALIDATION_BACKEND = args.validation_backend
+        settings.BATCH_SIZE = args.batch_size
+        settings.BATCH_KIB = args.batch_kib
+        settings.SCHEDULE = args.schedule
+        settings.MAX_FILES_PER_WORKER = args.max_files_per_worker
+        settings.MAX_WORKER_RSS = args.max_worker_rss
+        settings.MEMORY_BUDGET = args.memory_budget
+
         if args.enable_logging:
             settings.LOG_LEVEL = args.log_level
         else:
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Dict, Optional, Union, no_type_check
+from typing import Dict, List, Optional, Union, no_type_check
 
 from pydantic import BaseSettings, validator
 
@@ -7,7 +7,9 @@ from waterloo.types import (
     LOG_LEVEL_LABELS,
     ImportCollisionPolicy,
     LogLevel,
+    SchedulePolicy,
     UnpathedTypePolicy,
+    ValidationBackend,
 )
 
 
@@ -43,6 +45,20 @@ class Settings(CoerceEnumSettings):
     VERBOSE_ECHO: bool = True
     LOG_LEVEL: LogLevel = LogLevel.INFO
 
+    EXCLUDE: List[str] = []
+    INCLUDE: List[str] = []
+    USE_GITIGNORE: bool = False
+
+    CACHE_DIR: Optional[str] = None
+    DOCSTRING_CACHE_SIZE: int = 1024
+    VALIDATION_BACKEND: ValidationBackend = ValidationBackend.FISSIX
+    BATCH_SIZE: int = 16
+    BATCH_KIB: int = 64  # KiB
+    SCHEDULE: SchedulePolicy = SchedulePolicy.DISCOVERY
+    MAX_FILES_PER_WORKER: Optional[int] = None
+    MAX_WORKER_RSS: Optional[int] = None  # MiB
+    MEMORY_BUDGET: Optional[int] = None  # MiB
+
     @validator("IMPORT_COLLISION_POLICY")
     def key_to_member(
         cls, value: Union[ImportCollisionPolicy, str]
@@ -29,7 +29,12 @@ from waterloo.types import (
 from .python import python_identifier
 from .utils import typed_mark
 
-__all__ = ("docstring_parser", "_nested")
+__all__ = (
+    "docstring_parser",
+    "docstring_section_head",
+    "section_head_prescan",
+    "_nested",
+)
 
 
 # logging.basicConfig(level=logging.DEBUG)
@@ -71,6 +76,26 @@ returns_section_name = parsy.regex(
 
 returns_head = returns_section_name << parsy.string(":") << (sc + char.eol)
 
+_section_head_names = r"|".join(
+    re.escape(name)
+    for name in sorted(
+        VALID_ARGS_SECTION_NAMES | VALID_RETURNS_SECTION_NAMES.keys(),
+        key=len,
+        reverse=True,
+    )
+)
+
+# cheap check of the raw bytes of a source file, for whether it could contain
+# any docstring section heads we care about (i.e. a superset of what the
+# parsers above will match) so that we can skip files which can't
+section_head_prescan = re.compile(f"(?:{_section_head_names}):".encode("ascii")).search
+
+# as above, for a single docstring: if this doesn't match then we know that
+# `docstring_parser` would not find any types
+docstring_section_head = re.compile(
+    rf"^\s*(?:{_section_head_names}):", re.MULTILINE
+).search
+
 
 # PYTHON IDENTIFIERS
 
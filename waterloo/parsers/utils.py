@@ -1,3 +1,5 @@
+from bisect import bisect_right
+from functools import lru_cache
 from typing import Any, Generator, Tuple
 
 import parsy
@@ -8,12 +10,43 @@ from waterloo.types import SourcePos
 TypedMarkReturnT = Tuple[SourcePos, Any, SourcePos]
 
 
+@lru_cache(maxsize=8)
+def _line_starts(stream: str) -> Tuple[int, ...]:
+    """
+    Offsets of the start of each line in `stream`, computed once per input.
+    """
+    starts = [0]
+    index = stream.find("\n")
+    while index != -1:
+        starts.append(index + 1)
+        index = stream.find("\n", index + 1)
+    return tuple(starts)
+
+
+def line_info_at(stream: str, index: int) -> SourcePos:
+    """
+    As per `parsy.line_info_at` but, rather than counting newlines from the
+    start of `stream` on each call, bisects an index of line start offsets.
+    """
+    if index > len(stream):
+        raise ValueError("invalid index")
+    starts = _line_starts(stream)
+    row = bisect_right(starts, index) - 1
+    return SourcePos(row, index - starts[row])
+
+
+# parser returning the current (row, col) position without consuming input
+line_info = parsy.Parser(
+    lambda stream, index: parsy.Result.success(index, line_info_at(stream, index))
+)
+
+
 def typed_mark(p: parsy.Parser, factory=lambda *args: args):
     @parsy.generate
     def marked() -> Generator[parsy.Parser, parsy.Parser, TypedMarkReturnT]:
-        start = SourcePos(*(yield parsy.line_info))
+        start = yield line_info
         body = yield p
-        end = SourcePos(*(yield parsy.line_info))
+        end = yield line_info
         return factory(start, body, end)
 
     return marked
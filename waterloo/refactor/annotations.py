@@ -1,22 +1,26 @@
-from typing import Dict, Sequence
+from functools import partial
+from typing import Dict, Optional, Sequence
 
 import inject
 import parsy
-from bowler import LN, Capture, Filename
+from bowler import LN, Capture, Filename, Fixers, ResultCache
 from fissix.fixer_util import Newline
 from fissix.pgen2 import token
 from fissix.pygram import python_symbols as syms
 from fissix.pytree import Leaf, Node
-from structlog.threadlocal import bind_threadlocal, clear_threadlocal
 
+from waterloo import configure_for_settings
+from waterloo.__about__ import __version__
 from waterloo.conf.types import Settings
-from waterloo.parsers.napoleon import docstring_parser
+from waterloo.parsers.napoleon import docstring_section_head, section_head_prescan
 from waterloo.printer import StylePrinter
 from waterloo.refactor.base import NonMatchingFixer, WaterlooQuery, interrupt_modifier
+from waterloo.refactor.context import FileContext
 from waterloo.refactor.exceptions import Interrupt
 from waterloo.refactor.reporter import (
     report_ambiguous_type_error,
     report_doc_args_signature_mismatch_error,
+    report_file_summary,
     report_generator_annotation,
     report_incomplete_arg_types,
     report_incomplete_return_type,
@@ -24,13 +28,13 @@ from waterloo.refactor.reporter import (
     report_settings,
 )
 from waterloo.refactor.utils import (
-    ImportStrategist,
-    find_local_types,
     get_import_lines,
+    get_signature,
     get_type_comment,
     remove_types,
 )
 from waterloo.types import (
+    PRINTABLE_SETTINGS,
     AmbiguousTypeError,
     ArgTypes,
     ImportStrategy,
@@ -39,88 +43,15 @@ from waterloo.types import (
 )
 
 
-@inject.params(settings="settings", threadlocals="threadlocals")
-def _init_threadlocals(filename, settings, threadlocals):
-    threadlocals.settings = settings
-
-    local_types = find_local_types(filename)
-    threadlocals.signatures = local_types.signatures
-    threadlocals.import_strategist = ImportStrategist(local_types)
-    threadlocals.strategy_to_names = {}
-
-    # per-file counters
-    threadlocals.docstring_count = 0
-    threadlocals.typed_docstring_count = 0
-    threadlocals.comment_count = 0
-    threadlocals.warning_count = 0
-    threadlocals.error_count = 0
-
-    # for the structlog logger (it manages its own threadlocals):
-    clear_threadlocal()
-    bind_threadlocal(filename=filename)
-
-
-@inject.params(threadlocals="threadlocals")
-def _cleanup_threadlocals(threadlocals):
-    for key in list(threadlocals.__dict__.keys()):
-        try:
-            delattr(threadlocals, key)
-        except AttributeError:
-            pass
-    # for the structlog logger:
-    clear_threadlocal()
-
-
-@inject.params(threadlocals="threadlocals")
-def record_type_names(name_to_strategy: Dict[str, ImportStrategy], threadlocals):
-    for name, strategy in name_to_strategy.items():
-        threadlocals.strategy_to_names.setdefault(strategy, set()).add(name)
-
-
 class StartFile(NonMatchingFixer):
-    echo = inject.attr("echo")
-
     def start_tree(self, tree: Node, filename: str) -> None:
-        self.echo.info(f"<b>{filename}</b>", verbose=False)
-        _init_threadlocals(filename)
+        self.context.echo.info(f"<b>{filename}</b>", verbose=False)
+        self.context.start_tree(tree)
 
 
 class EndFile(NonMatchingFixer):
-    echo = inject.attr("echo")
-    logger = inject.attr("log")
-    threadlocals = inject.attr("threadlocals")
-
     def finish_tree(self, tree: Node, filename: str) -> None:
-        if self.threadlocals.comment_count:
-            self.logger.info(
-                f"{self.threadlocals.comment_count} type comments added in file."
-            )
-            self.echo.info(
-                f"➤➤ <b>{self.threadlocals.comment_count}</b> type comments added in file 🎉",
-                verbose=False,
-            )
-        else:
-            self.logger.info("no docstrings with annotatable types found in file.")
-            self.echo.info(
-                "➤➤ (no docstrings with annotatable types found in file)", verbose=False
-            )
-
-        if self.threadlocals.warning_count:
-            self.logger.info(f"{self.threadlocals.warning_count} warnings in file.")
-            self.echo.info(
-                f"➤➤ <b>{self.threadlocals.warning_count}</b> warnings in file ⚠️",
-                verbose=False,
-            )
-
-        if self.threadlocals.error_count:
-            self.logger.info(f"{self.threadlocals.error_count} errors in file.")
-            self.echo.info(
-                f"➤➤ <b>{self.threadlocals.error_count}</b> errors in file 🛑",
-                verbose=False,
-            )
-
-        self.echo.info("", verbose=False)
-        _cleanup_threadlocals()
+        report_file_summary(self.context.stats(), self.context)
 
 
 def f_not_already_annotated_py2(node: LN, capture: Capture, filename: Filename) -> bool:
@@ -141,26 +72,29 @@ def f_not_already_annotated_py2(node: LN, capture: Capture, filename: Filename)
 
 
 @interrupt_modifier
-@inject.params(threadlocals="threadlocals")
-def m_add_type_comment(
-    node: LN, capture: Capture, filename: Filename, threadlocals
-) -> LN:
+def m_add_type_comment(node: LN, capture: Capture, filename: Filename) -> LN:
     """
     (modifier)
 
     Adds type comment annotations for functions, as understood by
     `mypy --py2` type checking.
     """
-    threadlocals.docstring_count += 1
+    ctx: FileContext = capture["context"]
+    ctx.docstring_count += 1
     # since we filtered for funcs with a docstring, the initial_indent_node
     # should be the indent before the start of the docstring quotes.
     initial_indent = capture["initial_indent_node"]
     function: Leaf = capture["function_name"]
+    docstring = capture["docstring_node"].value
+
+    # most docstrings have no sections, we can skip the (slow) parser for them
+    if not docstring_section_head(docstring):
+        raise Interrupt
 
     try:
-        doc_annotation = docstring_parser.parse(capture["docstring_node"].value)
+        doc_annotation = ctx.parse_docstring(docstring)
     except parsy.ParseError as e:
-        report_parse_error(e, function)
+        report_parse_error(e, function, ctx)
         raise Interrupt
 
     if not doc_annotation.has_types:
@@ -169,13 +103,12 @@ def m_add_type_comment(
     annotation_arg_names = (
         doc_annotation.arg_types.args.keys() if doc_annotation.arg_types else set()
     )
-    signature_name, signature_arg_names = threadlocals.signatures[node.get_lineno()]
-    assert signature_name == function.value, f"{signature_name} != {function.value}"
+    _, signature_arg_names = get_signature(node)
 
     if doc_annotation.arg_types and not annotation_arg_names == set(
         signature_arg_names
     ):
-        report_doc_args_signature_mismatch_error(function)
+        report_doc_args_signature_mismatch_error(function, ctx)
         raise Interrupt
     # we either have no annotation args, or we do and the names match the signature
 
@@ -185,8 +118,8 @@ def m_add_type_comment(
     if signature_arg_names and (
         not doc_annotation.arg_types or not doc_annotation.arg_types.is_fully_typed
     ):
-        report_incomplete_arg_types(function)
-        if not threadlocals.settings.ALLOW_UNTYPED_ARGS:
+        report_incomplete_arg_types(function, ctx)
+        if not ctx.settings.ALLOW_UNTYPED_ARGS:
             raise Interrupt
     elif not signature_arg_names and not doc_annotation.arg_types:
         # special case: replace doc_annotation with one having empty args
@@ -197,12 +130,12 @@ def m_add_type_comment(
         )
 
     if not doc_annotation.return_type or not doc_annotation.return_type.is_fully_typed:
-        report_incomplete_return_type(function)
-        if threadlocals.settings.REQUIRE_RETURN_TYPE:
+        report_incomplete_return_type(function, ctx)
+        if ctx.settings.REQUIRE_RETURN_TYPE:
             raise Interrupt
 
     # yes, annotate...
-    threadlocals.typed_docstring_count += 1
+    ctx.typed_docstring_count += 1
 
     # print(doc_annotation.return_type, doc_annotation.return_type.is_fully_typed, doc_annotation.return_type.name is ReturnsSection.YIELDS)
     if (
@@ -210,36 +143,61 @@ def m_add_type_comment(
         and doc_annotation.return_type.is_fully_typed
         and doc_annotation.return_type.name is ReturnsSection.YIELDS
     ):
-        report_generator_annotation(function)
+        report_generator_annotation(function, ctx)
 
     # record the types we found in this docstring
     # and warn/fail on ambiguous types according to IMPORT_COLLISION_POLICY
     name_to_strategy: Dict[str, ImportStrategy] = {}
     for name in doc_annotation.type_names():
         try:
-            name_to_strategy[name] = threadlocals.import_strategist.get_for_name(name)
+            name_to_strategy[name] = ctx.import_strategist.get_for_name(
+                name, settings=ctx.settings
+            )
         except AmbiguousTypeError as e:
-            report_ambiguous_type_error(e, function)
+            report_ambiguous_type_error(e, function, ctx)
             if e.should_fail:
                 raise Interrupt
 
-    record_type_names(name_to_strategy)
+    ctx.record_type_names(name_to_strategy)
 
     # add the type comment as first line of func body (before docstring)
     type_comment = get_type_comment(doc_annotation, name_to_strategy)
+    old_lines = str(initial_indent).count("\n") + docstring.count("\n")
     initial_indent.prefix = f"{initial_indent}{type_comment}\n"
-    threadlocals.comment_count += 1
+    ctx.comment_count += 1
 
     # remove types from docstring
     new_docstring_node = capture["docstring_node"].clone()
     new_docstring_node.value = remove_types(
-        docstring=capture["docstring_node"].value, signature=doc_annotation,
+        docstring=docstring, signature=doc_annotation,
     )
     capture["docstring_node"].replace(new_docstring_node)
 
+    # we changed the lines from the end of the `def` up to end of the docstring
+    new_lines = str(initial_indent).count("\n") + new_docstring_node.value.count("\n")
+    start = _end_lineno(initial_indent.prev_sibling)
+    end = capture["docstring_node"].lineno + docstring.count("\n")
+    ctx.record_edit_region(
+        None if start is None else (start, end, new_lines - old_lines)
+    )
+
     return node
 
 
+def _end_lineno(node: LN) -> Optional[int]:
+    """
+    Returns:
+        (1-indexed) line number of the end of the line terminated by `node`,
+        i.e. the 0-indexed number of the next line, or `None` if `node` does
+        not end with a newline
+    """
+    while isinstance(node, Node) and node.children:
+        node = node.children[-1]
+    if node.type != token.NEWLINE:
+        return None
+    return node.lineno
+
+
 def _find_import_pos(root: Node) -> int:
     """
     This logic cribbed from `fissix.fix_utils.touch_import`
@@ -325,12 +283,10 @@ class AddTypeImports(NonMatchingFixer):
     configured via IMPORT_COLLISION_POLICY and UNPATHED_TYPE_POLICY settings.
     """
 
-    threadlocals = inject.attr("threadlocals")
-
     def finish_tree(self, tree: Node, filename: str) -> None:
         # TODO: what about name clash between dotted-path imports and
         # introspected locals?
-        imports_dict = get_import_lines(self.threadlocals.strategy_to_names)
+        imports_dict = get_import_lines(self.context.strategy_to_names)
         insert_pos = _find_import_pos(tree)
 
         def _sort_key(val):
@@ -343,6 +299,7 @@ class AddTypeImports(NonMatchingFixer):
             key=_sort_key,
             reverse=True,  # because we insert last nodes first
         )
+        inserted_lines = 0
         for i, (left, right) in enumerate(sorted_tuples):
             if left:
                 import_node = _make_from_import_node(
@@ -351,12 +308,111 @@ class AddTypeImports(NonMatchingFixer):
                     trailing_nl=i == 0 and insert_pos == 0,
                 )
                 tree.insert_child(insert_pos, import_node)
+                inserted_lines += str(import_node).count("\n")
             else:
                 for j, name in enumerate(right):
                     import_node = _make_bare_import_node(
                         name=name, trailing_nl=i == 0 and j == 0 and insert_pos == 0,
                     )
                     tree.insert_child(insert_pos, import_node)
+                    inserted_lines += str(import_node).count("\n")
+
+        if inserted_lines:
+            if insert_pos == 0:
+                self.context.record_edit_region((0, 0, inserted_lines))
+            else:
+                row = _end_lineno(tree.children[insert_pos - 1])
+                self.context.record_edit_region(
+                    None if row is None else (row, row, inserted_lines)
+                )
+
+
+# functions having a docstring
+FUNCDEF_DOCSTRING_PATTERN = r"""
+    funcdef <
+        'def' function_name=any
+        function_parameters=parameters< '(' function_arguments=any* ')' >
+        any* ':'
+        suite < '\n'
+            initial_indent_node=any
+            simple_stmt < docstring_node=STRING any* >
+            any*
+        >
+    >
+"""
+
+
+def match_funcdef_docstring(node: LN) -> Optional[Capture]:
+    """
+    Equivalent to matching `FUNCDEF_DOCSTRING_PATTERN` against a `funcdef`
+    node (giving the same Capture), but without the generic matcher having
+    to backtrack over the wildcards.
+    """
+    children = node.children
+    if len(children) < 5:
+        return None
+    def_, function_name, parameters = children[:3]
+    colon, suite = children[-2:]
+    if (
+        def_.type != token.NAME
+        or def_.value != "def"
+        or parameters.type != syms.parameters
+        or colon.type != token.COLON
+        or suite.type != syms.suite
+    ):
+        return None
+
+    params = parameters.children
+    if len(params) < 2 or params[0].type != token.LPAR or params[-1].type != token.RPAR:
+        return None
+
+    body = suite.children
+    if len(body) < 3:
+        return None
+    newline, initial_indent, first_stmt = body[:3]
+    if (
+        newline.type != token.NEWLINE
+        or newline.value != "\n"
+        or first_stmt.type != syms.simple_stmt
+        or first_stmt.children[0].type != token.STRING
+    ):
+        return None
+
+    return {
+        "node": node,
+        "function_name": function_name,
+        "function_parameters": parameters,
+        "function_arguments": params[1:-1],
+        "initial_indent_node": initial_indent,
+        "docstring_node": first_stmt.children[0],
+    }
+
+
+def _annotate_query(*paths: str, python_version: int) -> WaterlooQuery:
+    return (
+        WaterlooQuery(*paths, python_version=python_version)
+        .select_matcher(match_funcdef_docstring, syms.funcdef)
+        .filter(f_not_already_annotated_py2)
+        .modify(m_add_type_comment)
+        .raw_fixer(StartFile)
+        .raw_fixer(AddTypeImports)
+        .raw_fixer(EndFile)
+    )
+
+
+def _annotate_fixers(python_version: int) -> Fixers:
+    """
+    Recipe for bowler worker processes to rebuild our fixers.
+    """
+    return _annotate_query(python_version=python_version).compile()
+
+
+def _cache_fingerprint(settings: Settings) -> str:
+    """
+    Everything other than the file contents which can affect the result.
+    """
+    values = {key: str(getattr(settings, key)) for key in sorted(PRINTABLE_SETTINGS)}
+    return f"{__version__}:{values!r}"
 
 
 @inject.params(settings="settings", echo="echo")
@@ -378,28 +434,29 @@ def annotate(
     """
     report_settings()
 
-    q = (
-        WaterlooQuery(
-            *paths, python_version=int(str(settings.PYTHON_VERSION).split(".", 1)[0]),
-        )
-        .select(
-            r"""
-            funcdef <
-                'def' function_name=any
-                function_parameters=parameters< '(' function_arguments=any* ')' >
-                any* ':'
-                suite < '\n'
-                    initial_indent_node=any
-                    simple_stmt < docstring_node=STRING any* >
-                    any*
-                >
-            >
-        """
-        )
-        .filter(f_not_already_annotated_py2)
-        .modify(m_add_type_comment)
-        .raw_fixer(StartFile)
-        .raw_fixer(AddTypeImports)
-        .raw_fixer(EndFile)
+    python_version = int(str(settings.PYTHON_VERSION).split(".", 1)[0])
+    q = _annotate_query(*paths, python_version=python_version)
+    execute_kwargs.setdefault(
+        "fixers_factory", partial(_annotate_fixers, python_version)
     )
+    execute_kwargs.setdefault(
+        "worker_initializer", partial(configure_for_settings, settings)
+    )
+    execute_kwargs.setdefault("exclude", settings.EXCLUDE)
+    execute_kwargs.setdefault("include", settings.INCLUDE)
+    execute_kwargs.setdefault("gitignore", settings.USE_GITIGNORE)
+    execute_kwargs.setdefault("source_matcher", section_head_prescan)
+    execute_kwargs.setdefault("validation", settings.VALIDATION_BACKEND.value)
+    execute_kwargs.setdefault("batch_size", settings.BATCH_SIZE)
+    execute_kwargs.setdefault("batch_bytes", settings.BATCH_KIB * 2 ** 10)
+    execute_kwargs.setdefault("schedule", settings.SCHEDULE.value)
+    execute_kwargs.setdefault("max_files_per_worker", settings.MAX_FILES_PER_WORKER)
+    if settings.MAX_WORKER_RSS:
+        execute_kwargs.setdefault("max_worker_rss", settings.MAX_WORKER_RSS * 2 ** 20)
+    if settings.MEMORY_BUDGET:
+        execute_kwargs.setdefault("memory_budget", settings.MEMORY_BUDGET * 2 ** 20)
+    if settings.CACHE_DIR:
+        execute_kwargs.setdefault(
+            "cache", ResultCache(settings.CACHE_DIR, _cache_fingerprint(settings))
+        )
     q.execute(**execute_kwargs)
@@ -1,24 +1,88 @@
 from functools import wraps
-from typing import List, Optional, Type
-
-from bowler import LN, Capture, Filename, Query
+from typing import Dict, List, Optional, Type
+
+import inject
+from bowler import (
+    LN,
+    BowlerTool,
+    Capture,
+    EditRegion,
+    Filename,
+    FilenameMatcher,
+    LifecycleFixer,
+    Query,
+)
 from fissix.fixer_base import BaseFix
 
+from waterloo.refactor.context import RUN_COUNTERS, FileContext
 from waterloo.refactor.exceptions import Interrupt
+from waterloo.refactor.reporter import (
+    report_cached_file,
+    report_run_summary,
+    report_skipped_file,
+)
+
+
+class WaterlooTool(BowlerTool):
+    """
+    Creates the `FileContext` used by our fixers for each file, so that its
+    per-file counters can be returned to the parent process as `file_stats`
+    (for caching and the end-of-run summary).
+    """
 
+    context: FileContext
 
-class NonMatchingFixer(BaseFix):
-    PATTERN = None  # type: ignore
-    BM_compatible = False
+    def file_context(self, filename: str) -> FileContext:
+        return FileContext(
+            filename,
+            settings=inject.instance("settings"),
+            echo=inject.instance("echo"),
+            log=inject.instance("log"),
+            docstring_parser=inject.instance("docstring_parser"),
+        )
 
-    def match(self, node: LN) -> bool:
-        # we don't need to participate in the matching phase, we just want
-        # our `finish_tree` method to be called once after other modifiers
-        # have completed their work...
-        return False
+    def refactor_file(self, filename: str, *args, **kwargs):
+        try:
+            return super().refactor_file(filename, *args, **kwargs)
+        finally:
+            self.file_stats.update(self.context.stats())
+
+    def edit_regions(self, filename: str) -> Optional[List[EditRegion]]:
+        # (recorded by our fixers, if they were able to)
+        return self.context.edit_regions
+
+    def skipped_file(self, filename: str) -> None:
+        super().skipped_file(filename)
+        report_skipped_file(self.context)
+
+    def cacheable_stats(self, stats: Dict[str, int]) -> Optional[Dict[str, int]]:
+        # the warning and error messages themselves aren't cached, so such
+        # files are processed again to report them
+        if stats.get("warning_count") or stats.get("error_count"):
+            return None
+        return {
+            name: count for name, count in stats.items() if name not in RUN_COUNTERS
+        }
+
+    def report_cached_file(self, filename: Filename, stats: Dict[str, int]) -> None:
+        # (the file isn't processed, this is just for reporting)
+        report_cached_file(stats, self.file_context(filename))
+
+    def summarize(self) -> None:
+        super().summarize()
+        report_run_summary(
+            self.run_stats, echo=inject.instance("echo"), log=inject.instance("log")
+        )
+
+
+class NonMatchingFixer(LifecycleFixer):
+    """
+    We don't need to participate in the matching phase, we just want our
+    `start_tree` / `finish_tree` methods called once per file, before / after
+    other modifiers have completed their work...
+    """
 
-    def transform(self, node: LN, capture: Capture) -> Optional[LN]:
-        return node
+    context: FileContext
 
 
 class WaterlooQuery(Query):
@@ -33,6 +97,8 @@ class WaterlooQuery(Query):
     See https://github.com/jreese/fissix/blob/master/fissix/fixer_base.py
     """
 
+    TOOL_CLASS = WaterlooTool
+
     raw_fixers: List[Type[BaseFix]]
 
     def __init__(self, *paths, **kwargs) -> None:
@@ -48,6 +114,13 @@ class WaterlooQuery(Query):
         fixers.extend(self.raw_fixers)
         return fixers
 
+    def compile_filename_filter(self) -> Optional[FilenameMatcher]:
+        # lifecycle fixers only act on what the other fixers matched, but
+        # any other raw fixer could match in any file
+        if not all(issubclass(fx, LifecycleFixer) for fx in self.raw_fixers):
+            return None
+        return super().compile_filename_filter()
+
 
 def interrupt_modifier(f):
     @wraps(f)
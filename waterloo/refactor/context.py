@@ -0,0 +1,122 @@
+from typing import Callable, Dict, List, Optional, Set
+
+from bowler import EditRegion
+from fissix.pytree import Node
+
+from waterloo.conf.types import Settings
+from waterloo.printer import StylePrinter
+from waterloo.refactor.utils import ImportStrategist, collect_local_types
+from waterloo.types import ImportStrategy, TypeSignature
+
+# per-file counters, returned to the parent process as the file's stats
+FILE_COUNTERS = (
+    "docstring_count",
+    "typed_docstring_count",
+    "comment_count",
+    "warning_count",
+    "error_count",
+    "docstring_cache_hits",
+    "docstring_cache_misses",
+)
+
+# counters describing this run's processing of the file rather than the file
+# itself, which shouldn't be replayed from the result cache
+RUN_COUNTERS = frozenset(("docstring_cache_hits", "docstring_cache_misses"))
+
+
+class FileContext:
+    """
+    State for processing a single file.
+
+    Created by `WaterlooTool` for each file and passed explicitly to our
+    fixers (as `fixer.context`, or `capture["context"]` in modifiers) and on
+    to the reporters, rather than those each looking up shared state.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        settings: Settings,
+        echo: StylePrinter,
+        log,
+        docstring_parser: Callable[[str], TypeSignature],
+    ):
+        self.filename = filename
+        self.settings = settings
+        self.echo = echo
+        self.log = log.bind(filename=filename)
+        self.docstring_parser = docstring_parser
+
+        self.docstring_count = 0
+        self.typed_docstring_count = 0
+        self.comment_count = 0
+        self.warning_count = 0
+        self.error_count = 0
+        self.docstring_cache_hits = 0
+        self.docstring_cache_misses = 0
+
+        self.strategy_to_names: Dict[ImportStrategy, Set[str]] = {}
+        self.edit_regions: Optional[List[EditRegion]] = []
+
+        self._tree: Optional[Node] = None
+        self._import_strategist: Optional[ImportStrategist] = None
+
+    def start_tree(self, tree: Node) -> None:
+        self._tree = tree
+        self._import_strategist = None
+
+    @property
+    def import_strategist(self) -> ImportStrategist:
+        """
+        Collecting the local types means walking the whole tree, so we only
+        do it once we have a typed docstring whose types need resolving
+        (most files don't have any).
+
+        Our modifiers only add comments and edit docstrings before this is
+        used, which doesn't affect the local types.
+        """
+        if self._import_strategist is None:
+            assert self._tree is not None, "start_tree has not been called"
+            self._import_strategist = ImportStrategist(collect_local_types(self._tree))
+        return self._import_strategist
+
+    def stats(self) -> Dict[str, int]:
+        stats: Dict[str, int] = {}
+        for name in FILE_COUNTERS:
+            stats[name] = getattr(self, name)
+        return stats
+
+    def parse_docstring(self, docstring: str) -> TypeSignature:
+        """
+        Parse via the (per-process, LRU-cached) `docstring_parser`, counting
+        cache hits and misses for the file.
+        """
+        hits = self.docstring_parser.cache_info().hits  # type: ignore
+        try:
+            signature = self.docstring_parser(docstring)
+        except Exception:
+            # (failures aren't cached)
+            self.docstring_cache_misses += 1
+            raise
+        if self.docstring_parser.cache_info().hits > hits:  # type: ignore
+            self.docstring_cache_hits += 1
+        else:
+            self.docstring_cache_misses += 1
+        return signature
+
+    def record_edit_region(self, region: Optional[EditRegion]) -> None:
+        """
+        Record the lines we changed, so that `WaterlooTool` can diff just those.
+
+        Args:
+            region: `None` if we don't know where our edit was (in which case
+                the whole file will be diffed)
+        """
+        if region is None:
+            self.edit_regions = None
+        elif self.edit_regions is not None:
+            self.edit_regions.append(region)
+
+    def record_type_names(self, name_to_strategy: Dict[str, ImportStrategy]) -> None:
+        for name, strategy in name_to_strategy.items():
+            self.strategy_to_names.setdefault(strategy, set()).add(name)
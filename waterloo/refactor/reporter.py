@@ -1,10 +1,13 @@
 from enum import Enum
 from functools import singledispatch
+from typing import Dict
 
 import inject
 import parsy
 from fissix.pytree import Leaf
 
+from waterloo.printer import StylePrinter
+from waterloo.refactor.context import FileContext
 from waterloo.types import (
     PRINTABLE_SETTINGS,
     AmbiguousTypeError,
@@ -34,17 +37,16 @@ def report_settings(settings, echo):
     echo.debug("", verbose=True)
 
 
-@inject.params(echo="echo", log="log", threadlocals="threadlocals")
-def report_parse_error(e: parsy.ParseError, function: Leaf, echo, log, threadlocals):
-    threadlocals.error_count += 1
+def report_parse_error(e: parsy.ParseError, function: Leaf, ctx: FileContext):
+    ctx.error_count += 1
     # fmt: off
-    log.error(
+    ctx.log.error(
         "Error parsing docstring.",
         line_no=function.lineno,
         func_name=function.value,
         error=e,
     )
-    echo.error(
+    ctx.echo.error(
         f"🛑 <b>line {function.lineno}:</b> Error parsing docstring for <b>def {function.value}</b>\n"
         f"   {e!r}",
         verbose=True
@@ -52,11 +54,10 @@ def report_parse_error(e: parsy.ParseError, function: Leaf, echo, log, threadloc
     # fmt: on
 
 
-@inject.params(echo="echo", log="log", threadlocals="threadlocals")
-def report_doc_args_signature_mismatch_error(function: Leaf, echo, log, threadlocals):
-    threadlocals.error_count += 1
+def report_doc_args_signature_mismatch_error(function: Leaf, ctx: FileContext):
+    ctx.error_count += 1
     # fmt: off
-    log.error(
+    ctx.log.error(
         "Docstring has arg names which are inconsistent with the function signature.",
         line_no=function.lineno,
         func_name=function.value,
@@ -65,7 +66,7 @@ def report_doc_args_signature_mismatch_error(function: Leaf, echo, log, threadlo
         f"<b>line {function.lineno}:</b> Docstring for <b>def {function.value}</b> has arg names which are "
         f"inconsistent with the function signature."
     )
-    echo.error(
+    ctx.echo.error(
         f"🛑 {msg}\n"
         f"   ➤ no type annotation added",
         verbose=True
@@ -73,30 +74,29 @@ def report_doc_args_signature_mismatch_error(function: Leaf, echo, log, threadlo
     # fmt: on
 
 
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def report_incomplete_arg_types(function: Leaf, settings, echo, log, threadlocals):
+def report_incomplete_arg_types(function: Leaf, ctx: FileContext):
     # fmt: off
     msg = f"<b>line {function.lineno}:</b> Docstring for <b>def {function.value}</b> did not fully specify arg types."
-    if not settings.ALLOW_UNTYPED_ARGS:
-        threadlocals.error_count += 1
-        log.error(
+    if not ctx.settings.ALLOW_UNTYPED_ARGS:
+        ctx.error_count += 1
+        ctx.log.error(
             "Docstring did not fully specify arg types: no type annotation added.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.error(
+        ctx.echo.error(
             f"🛑 {msg}\n"
             f"   ➤ no type annotation added",
             verbose=True
         )
     else:
-        threadlocals.warning_count += 1
-        log.warning(
+        ctx.warning_count += 1
+        ctx.log.warning(
             "Docstring did not fully specify arg types: args will be annotated as (...)",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.warning(
+        ctx.echo.warning(
             f"⚠️  {msg}\n"
             f"   ➤ args will be annotated as <b>(...)</b>",
             verbose=True
@@ -104,30 +104,29 @@ def report_incomplete_arg_types(function: Leaf, settings, echo, log, threadlocal
     # fmt: on
 
 
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def report_incomplete_return_type(function: Leaf, settings, echo, log, threadlocals):
+def report_incomplete_return_type(function: Leaf, ctx: FileContext):
     # fmt: off
     msg = f"<b>line {function.lineno}:</b> Docstring for <b>def {function.value}</b> did not specify a return type."
-    if settings.REQUIRE_RETURN_TYPE:
-        threadlocals.error_count += 1
-        log.error(
+    if ctx.settings.REQUIRE_RETURN_TYPE:
+        ctx.error_count += 1
+        ctx.log.error(
             "Docstring did not specify a return type: no type annotation added.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.error(
+        ctx.echo.error(
             f"🛑 {msg}\n"
             f"   ➤ no type annotation added",
             verbose=True
         )
     else:
-        threadlocals.warning_count += 1
-        log.warning(
+        ctx.warning_count += 1
+        ctx.log.warning(
             "Docstring did not specify a return type: return will be annotated as -> None",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.warning(
+        ctx.echo.warning(
             f"⚠️  {msg}\n"
             f"   ➤ return will be annotated as <b>-&gt; None</b>",
             verbose=True
@@ -135,10 +134,11 @@ def report_incomplete_return_type(function: Leaf, settings, echo, log, threadloc
     # fmt: on
 
 
-@inject.params(threadlocals="threadlocals")
 @singledispatch
-def report_ambiguous_type_error(e: AmbiguousTypeError, function: Leaf, threadlocals):
-    threadlocals.error_count += 1
+def report_ambiguous_type_error(
+    e: AmbiguousTypeError, function: Leaf, ctx: FileContext
+):
+    ctx.error_count += 1
     # fmt: off
     raise TypeError(
         f"Unexpected AmbiguousTypeError: {e!r}"
@@ -147,8 +147,7 @@ def report_ambiguous_type_error(e: AmbiguousTypeError, function: Leaf, threadloc
 
 
 @report_ambiguous_type_error.register
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def _(e: ModuleHasStarImportError, function: Leaf, settings, echo, log, threadlocals):
+def _(e: ModuleHasStarImportError, function: Leaf, ctx: FileContext):
     t_module, t_name = e.args
     assert t_module
     # fmt: off
@@ -156,29 +155,29 @@ def _(e: ModuleHasStarImportError, function: Leaf, settings, echo, log, threadlo
         f"<b>line {function.lineno}:</b> Ambiguous Type: <b>{t_module}.{t_name}</b> in docstring for <b>def {function.value}</b> "
         f"matches \"from {t_module} import *\" but we don't know if \"{t_name}\" is in *."
     )
-    if settings.IMPORT_COLLISION_POLICY is ImportCollisionPolicy.NO_IMPORT:
-        threadlocals.warning_count += 1
-        log.warning(
+    if ctx.settings.IMPORT_COLLISION_POLICY is ImportCollisionPolicy.NO_IMPORT:
+        ctx.warning_count += 1
+        ctx.log.warning(
             f"Ambiguous Type: {t_module}.{t_name} matches \"from {t_module} import *\" but we don't know if \"{t_name}\" is in *. "
             f"Annotation added: assumes existing import is sufficient.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.warning(
+        ctx.echo.warning(
             f"⚠️  {msg}\n"
             f"   ➤ annotation added: will assume existing import is sufficient\n"
             f"   ➤ if you would like a specific import to be added, undo this change and re-run with ImportCollisionPolicy.IMPORT",
             verbose=True
         )
     elif e.should_fail:
-        threadlocals.error_count += 1
-        log.error(
+        ctx.error_count += 1
+        ctx.log.error(
             f"Ambiguous Type: {t_module}.{t_name} matches \"from {t_module} import *\" but we don't know if \"{t_name}\" is in *. "
             f"No type annotation added.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.error(
+        ctx.echo.error(
             f"🛑 {msg}\n"
             f"   ➤ no type annotation added\n"
             f"   ➤ if you would like an import and annotation to be added, re-run with ImportCollisionPolicy.IMPORT",
@@ -187,14 +186,13 @@ def _(e: ModuleHasStarImportError, function: Leaf, settings, echo, log, threadlo
     else:
         raise ValueError(
             f"Unexpected fall-thru for {e.__class__.__name__} and "
-            f"IMPORT_COLLISION_POLICY={settings.IMPORT_COLLISION_POLICY.name}"
+            f"IMPORT_COLLISION_POLICY={ctx.settings.IMPORT_COLLISION_POLICY.name}"
         )
     # fmt: on
 
 
 @report_ambiguous_type_error.register
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def _(e: NameMatchesLocalClassError, function: Leaf, settings, echo, log, threadlocals):
+def _(e: NameMatchesLocalClassError, function: Leaf, ctx: FileContext):
     t_module, t_name = e.args
     type_path = f"{t_module}.{t_name}" if t_module else t_name
     # fmt: off
@@ -202,29 +200,29 @@ def _(e: NameMatchesLocalClassError, function: Leaf, settings, echo, log, thread
         f"<b>line {function.lineno}:</b> Ambiguous Type: <b>{type_path}</b> in docstring for <b>def {function.value}</b> "
         f"matches a \"class {t_name}\" also defined in the module, but we don't know if it is the same."
     )
-    if settings.IMPORT_COLLISION_POLICY is ImportCollisionPolicy.NO_IMPORT:
-        threadlocals.warning_count += 1
-        log.warning(
+    if ctx.settings.IMPORT_COLLISION_POLICY is ImportCollisionPolicy.NO_IMPORT:
+        ctx.warning_count += 1
+        ctx.log.warning(
             f"Ambiguous Type: {type_path} matches a \"class {t_name}\" also defined in the module, "
             f"but we don't know if it is the same. Annotation added: assumes it was intended to match local class def.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.warning(
+        ctx.echo.warning(
             f"⚠️  {msg}\n"
             f"   ➤ annotation added: will assume was intended to match local class def\n"
             f"   ➤ if you would like a specific import to be added, undo this change and re-run with ImportCollisionPolicy.IMPORT",
             verbose=True
         )
     elif e.should_fail:
-        threadlocals.error_count += 1
-        log.error(
+        ctx.error_count += 1
+        ctx.log.error(
             f"Ambiguous Type: {type_path} matches a \"class {t_name}\" also defined in the module, "
             f"but we don't know if it is the same. No type annotation added.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.error(
+        ctx.echo.error(
             f"🛑 {msg}\n"
             f"   ➤ no type annotation added\n"
             f"   ➤ if you would like an import and annotation to be added, re-run with ImportCollisionPolicy.IMPORT",
@@ -233,16 +231,13 @@ def _(e: NameMatchesLocalClassError, function: Leaf, settings, echo, log, thread
     else:
         raise ValueError(
             f"Unexpected fall-thru for {e.__class__.__name__} and "
-            f"IMPORT_COLLISION_POLICY={settings.IMPORT_COLLISION_POLICY.name}"
+            f"IMPORT_COLLISION_POLICY={ctx.settings.IMPORT_COLLISION_POLICY.name}"
         )
     # fmt: on
 
 
 @report_ambiguous_type_error.register
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def _(
-    e: NameMatchesRelativeImportError, function: Leaf, settings, echo, log, threadlocals
-):
+def _(e: NameMatchesRelativeImportError, function: Leaf, ctx: FileContext):
     t_module, t_name = e.args
     type_path = f"{t_module}.{t_name}" if t_module else t_name
     # fmt: off
@@ -250,29 +245,29 @@ def _(
         f"<b>line {function.lineno}:</b> Ambiguous Type: <b>{type_path}</b> in docstring for <b>def {function.value}</b> "
         f"matches a \"{t_name}\" imported from a relative path, but we don't know if it is the same."
     )
-    if settings.IMPORT_COLLISION_POLICY is ImportCollisionPolicy.NO_IMPORT:
-        threadlocals.warning_count += 1
-        log.warning(
+    if ctx.settings.IMPORT_COLLISION_POLICY is ImportCollisionPolicy.NO_IMPORT:
+        ctx.warning_count += 1
+        ctx.log.warning(
             f"Ambiguous Type: {type_path} matches a \"{t_name}\" imported from a relative path, "
             f"but we don't know if it is the same. Annotation added: assumes existing import is sufficient.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.warning(
+        ctx.echo.warning(
             f"⚠️  {msg}\n"
             f"   ➤ annotation added: will assume existing import is sufficient\n"
             f"   ➤ if you would like a specific import to be added, undo this change and re-run with ImportCollisionPolicy.IMPORT",
             verbose=True
         )
     elif e.should_fail:
-        threadlocals.error_count += 1
-        log.error(
+        ctx.error_count += 1
+        ctx.log.error(
             f"Ambiguous Type: {type_path} matches a \"{t_name}\" imported from a relative path, "
             f"but we don't know if it is the same. No type annotation added.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.error(
+        ctx.echo.error(
             f"🛑 {msg}\n"
             f"   ➤ no type annotation added\n"
             f"   ➤ if you would like an import and annotation to be added, re-run with ImportCollisionPolicy.IMPORT",
@@ -281,14 +276,13 @@ def _(
     else:
         raise ValueError(
             f"Unexpected fall-thru for {e.__class__.__name__} and "
-            f"IMPORT_COLLISION_POLICY={settings.IMPORT_COLLISION_POLICY.name}"
+            f"IMPORT_COLLISION_POLICY={ctx.settings.IMPORT_COLLISION_POLICY.name}"
         )
     # fmt: on
 
 
 @report_ambiguous_type_error.register
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def _(e: NotFoundNoPathError, function: Leaf, settings, echo, log, threadlocals):
+def _(e: NotFoundNoPathError, function: Leaf, ctx: FileContext):
     _, t_name = e.args
     # fmt: off
     msg = (
@@ -297,28 +291,28 @@ def _(e: NotFoundNoPathError, function: Leaf, settings, echo, log, threadlocals)
         f"a dotted-path we can use to add an import statement. However there are some forms we cannot auto-detect "
         f"which may mean no import is needed."
     )
-    if settings.UNPATHED_TYPE_POLICY in {UnpathedTypePolicy.WARN, UnpathedTypePolicy.IGNORE}:
-        threadlocals.warning_count += 1
-        log.warning(
+    if ctx.settings.UNPATHED_TYPE_POLICY in {UnpathedTypePolicy.WARN, UnpathedTypePolicy.IGNORE}:
+        ctx.warning_count += 1
+        ctx.log.warning(
             f"Ambiguous Type: {t_name} does not match any builtins, typing.<Type>, imported names or class def in the file, "
             f"and does not provide a dotted-path we can use to add an import statement. Annotation added: assumes no import needed.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.warning(
+        ctx.echo.warning(
             f"⚠️  {msg}\n"
             f"   ➤ annotation added: will assume no import needed",
             verbose=True
         )
     elif e.should_fail:
-        threadlocals.error_count += 1
-        log.error(
+        ctx.error_count += 1
+        ctx.log.error(
             f"Ambiguous Type: {t_name} does not match any builtins, typing.<Type>, imported names or class def in the file, "
             f"and does not provide a dotted-path we can use to add an import statement. No type annotation added.",
             line_no=function.lineno,
             func_name=function.value,
         )
-        echo.error(
+        ctx.echo.error(
             f"🛑 {msg}\n"
             f"   ➤ no type annotation added\n"
             f"   ➤ if you would like an annotation to be added (without accompanying import), re-run with UnpathedTypePolicy.WARN|IGNORE",
@@ -327,15 +321,14 @@ def _(e: NotFoundNoPathError, function: Leaf, settings, echo, log, threadlocals)
     else:
         raise ValueError(
             f"Unexpected fall-thru for {e.__class__.__name__} and "
-            f"UNPATHED_TYPE_POLICY={settings.UNPATHED_TYPE_POLICY.name}"
+            f"UNPATHED_TYPE_POLICY={ctx.settings.UNPATHED_TYPE_POLICY.name}"
         )
     # fmt: on
 
 
-@inject.params(settings="settings", echo="echo", log="log", threadlocals="threadlocals")
-def report_generator_annotation(function: Leaf, settings, echo, log, threadlocals):
-    threadlocals.warning_count += 1
-    log.warning(
+def report_generator_annotation(function: Leaf, ctx: FileContext):
+    ctx.warning_count += 1
+    ctx.log.warning(
         "Docstring contains a Yields section. We have annotated this as -> Generator[<yield type>, None, None]. "
         "If you also make use of a SendType and/or ReturnType then you will need to manually update this annotation.",
         line_no=function.lineno,
@@ -346,7 +339,90 @@ def report_generator_annotation(function: Leaf, settings, echo, log, threadlocal
         f"this as <b>-&gt; Generator[&lt;yield type&gt;, None, None]</b>. If you make use of a SendType and/or ReturnType then "
         f"you will need to manually update this annotation."
     )
-    echo.warning(
+    ctx.echo.warning(
         f"⚠️  {msg}\n" f"   ➤ annotation added: check if Generator type is correct",
         verbose=True,
     )
+
+
+def report_file_summary(stats: Dict[str, int], ctx: FileContext):
+    if stats["comment_count"]:
+        ctx.log.info(f"{stats['comment_count']} type comments added in file.")
+        ctx.echo.info(
+            f"➤➤ <b>{stats['comment_count']}</b> type comments added in file 🎉",
+            verbose=False,
+        )
+    else:
+        ctx.log.info("no docstrings with annotatable types found in file.")
+        ctx.echo.info(
+            "➤➤ (no docstrings with annotatable types found in file)", verbose=False
+        )
+
+    if stats["warning_count"]:
+        ctx.log.info(f"{stats['warning_count']} warnings in file.")
+        ctx.echo.info(
+            f"➤➤ <b>{stats['warning_count']}</b> warnings in file ⚠️", verbose=False,
+        )
+
+    if stats["error_count"]:
+        ctx.log.info(f"{stats['error_count']} errors in file.")
+        ctx.echo.info(
+            f"➤➤ <b>{stats['error_count']}</b> errors in file 🛑", verbose=False,
+        )
+
+    ctx.echo.info("", verbose=False)
+
+
+def report_skipped_file(ctx: FileContext):
+    ctx.log.info("no docstring section heads found, skipped file.")
+    ctx.echo.info(f"<b>{ctx.filename}</b>", verbose=False)
+    ctx.echo.info("➤➤ (no docstring sections found in file, skipped)", verbose=False)
+    ctx.echo.info("", verbose=False)
+
+
+def report_cached_file(stats: Dict[str, int], ctx: FileContext):
+    if stats.get("skipped_count"):
+        report_skipped_file(ctx)
+        return
+    ctx.log.info("using cached result for file.")
+    ctx.echo.info(f"<b>{ctx.filename}</b> (cached)", verbose=False)
+    report_file_summary(stats, ctx)
+
+
+def report_run_summary(stats: Dict[str, int], echo: StylePrinter, log):
+    log.info("run summary", **stats)
+    echo.info(
+        f"<b>{stats.get('file_count', 0)}</b> files processed "
+        f"(<b>{stats.get('cached_count', 0)}</b> from cache, "
+        f"<b>{stats.get('skipped_count', 0)}</b> skipped), "
+        f"<b>{stats.get('comment_count', 0)}</b> type comments added, "
+        f"<b>{stats.get('warning_count', 0)}</b> warnings, "
+        f"<b>{stats.get('error_count', 0)}</b> errors",
+        verbose=False,
+    )
+    echo.info(
+        f"docstring parse cache: <b>{stats.get('docstring_cache_hits', 0)}</b> hits, "
+        f"<b>{stats.get('docstring_cache_misses', 0)}</b> misses",
+        verbose=True,
+    )
+    if stats.get("batch_count"):
+        mean = stats.get("batched_file_count", 0) / stats["batch_count"]
+        echo.info(
+            f"batches of files sent to workers: <b>{stats['batch_count']}</b>, "
+            f"mean <b>{mean:.1f}</b> files per batch "
+            f"(max <b>{stats.get('batch_size', 0)}</b> files or "
+            f"<b>{stats.get('batch_bytes', 0) // 2 ** 10}</b> KiB)",
+            verbose=True,
+        )
+    if stats.get("recycled_count"):
+        echo.info(
+            f"worker processes replaced: <b>{stats['recycled_count']}</b>",
+            verbose=True,
+        )
+    if stats.get("peak_memory_estimate"):
+        echo.info(
+            f"peak estimated memory for files in progress: "
+            f"<b>{stats['peak_memory_estimate'] // 2 ** 20}</b> MiB "
+            f"(<b>{stats.get('deferred_batch_count', 0)}</b> batches deferred)",
+            verbose=True,
+        )
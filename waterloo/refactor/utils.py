@@ -4,10 +4,24 @@ import re
 import typing
 from enum import Enum, auto
 from itertools import chain
-from typing import Dict, Generator, List, Optional, Set, Tuple, Union, cast
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 import inject
-import parso
+from fissix import pygram, pytree
+from fissix.pgen2 import driver, token
+from fissix.pgen2.parse import ParseError
+from fissix.pygram import python_symbols as syms
 from fissix.pytree import Leaf, Node
 
 from waterloo.types import (
@@ -20,7 +34,6 @@ from waterloo.types import (
     NameToStrategy_T,
     NotFoundNoPathError,
     ReturnsSection,
-    Signatures,
     SourcePos,
     TypeAtom,
     TypeDef,
@@ -145,111 +158,280 @@ def _flatten_signature(elements: List[Union[Node, Leaf]]) -> Generator[str, None
                 yield f"{splat_context}{element.value}"
                 splat_context = ""
                 continue
+        elif name_context and element.type == syms.tname:
+            # annotated arg (Python 3), i.e. `name: type`
+            yield f"{splat_context}{element.children[0].value}"
+            splat_context = ""
+            continue
         else:
             # it's a Node, assume we're in value-context and discard
             assert not name_context
             continue
 
 
-def walk_tree(
-    node: parso.tree.NodeOrLeaf,
-) -> Generator[parso.tree.NodeOrLeaf, None, None]:
-    if hasattr(node, "children"):
-        yield node
-        for child in node.children:
-            for subchild in walk_tree(child):
-                yield subchild
-    else:
-        yield node
-
+def _get_arg_names(funcdef: Node) -> Tuple[str, ...]:
+    """
+    Args:
+        funcdef: `funcdef` node, whose children are:
+            'def' NAME parameters ['->' test] ':' suite
 
-def _is_staticmethod(node: parso.tree.Function) -> bool:
-    for decorator in node.get_decorators():
-        after_ampersand = decorator.children[1]
-        if after_ampersand.type == "name" and after_ampersand.value == "staticmethod":
+    Returns:
+        arg names from the signature, with splats e.g. `*args`
+    """
+    parameters = funcdef.children[2]
+    # children are: '(' [typedargslist | NAME | tname] ')'
+    if len(parameters.children) < 3:
+        return ()
+    args = parameters.children[1]
+    if args.type == syms.typedargslist:
+        elements = args.children
+    else:
+        elements = [args]
+    return tuple(_flatten_signature(elements))
+
+
+def _get_decorators(funcdef: Node) -> List[Node]:
+    parent = funcdef.parent
+    if parent is not None and parent.type == syms.async_funcdef:
+        parent = parent.parent
+    if parent is None or parent.type != syms.decorated:
+        return []
+    decorators = parent.children[0]
+    if decorators.type == syms.decorators:
+        return decorators.children
+    return [decorators]
+
+
+def _is_staticmethod(node: Node) -> bool:
+    for decorator in _get_decorators(node):
+        name = decorator.children[1]
+        if name.type == token.NAME and name.value == "staticmethod":
             return True
     return False
 
 
-def _is_method(node: parso.tree.Function) -> bool:
+def _is_method(node: Node) -> bool:
     while node.parent:
-        if node.parent.type == "classdef":
+        if node.parent.type == syms.classdef:
             return True
         node = node.parent
+    return False
 
 
-def _star_prefixed(param: parso.python.Param) -> str:
-    stars = "*" * param.star_count
-    return f"{stars}{param.name.value}"
+def _get_dotted_name(node: Union[Node, Leaf]) -> str:
+    """
+    Args:
+        node: a `dotted_name` node or a NAME leaf
+    """
+    if isinstance(node, Leaf):
+        return node.value
+    return "".join(leaf.value for leaf in node.leaves())
 
 
-@inject.params(settings="settings")
-def find_local_types(filename: str, settings) -> LocalTypes:
+def _get_import_from_module(node: Node) -> str:
     """
-    TODO: parso understands scopes so we could feasibly
-    determine visibility of non-top-level classdefs and imports
-    (currently we find defs at all levels)
-    TODO: if we don't do scopes maybe we should take top-level defs only
+    Args:
+        node: `import_from` node, whose children are:
+            'from' ('.'* dotted_name | '.'+) 'import' ...
+
+    Returns:
+        module path, with any leading dots of a relative import
     """
-    grammar = parso.load_grammar(version=settings.PYTHON_VERSION)
-    with open(filename) as f:
-        tree = grammar.parse(f.read(), path=filename)
+    prefix = ""
+    package = ""
+    for child in node.children[1:]:
+        if child.type == token.NAME and child.value == "import":
+            break
+        if child.type == token.DOT:
+            prefix += child.value
+        else:
+            package = _get_dotted_name(child)
+    return f"{prefix}{package}"
+
+
+def _get_import_from_names(node: Node) -> Optional[List[str]]:
+    """
+    Args:
+        node: `import_from` node
+
+    Returns:
+        the names bound by the import, or `None` for a star import
+    """
+    names = node.children[-1]
+    if names.type == token.RPAR:
+        names = node.children[-2]
+    if names.type == token.STAR:
+        return None
+    if names.type == syms.import_as_names:
+        elements = [child for child in names.children if child.type != token.COMMA]
+    else:
+        elements = [names]
+    return [
+        # `import_as_name` is: NAME 'as' NAME
+        element.children[-1].value if isinstance(element, Node) else element.value
+        for element in elements
+    ]
+
+
+def _get_import_name_path(node: Node) -> str:
+    """
+    Args:
+        node: `import_name` node, i.e. 'import' dotted_as_names
+
+    Returns:
+        the first dotted module path that is imported
+    """
+    imported = node.children[1]
+    if imported.type == syms.dotted_as_names:
+        imported = imported.children[0]
+    if imported.type == syms.dotted_as_name:
+        imported = imported.children[0]
+    return _get_dotted_name(imported)
+
+
+def _is_assignment_type_def(children: List[Union[Node, Leaf]], i: int) -> bool:
+    """
+    Is `children[i]` the name on the lhs of an assignment with one of
+    ASSIGNMENT_TYPE_DEFS on the rhs, e.g. `T = TypeVar("T")`
+    """
+    if i + 2 >= len(children):
+        return False
+    operator = children[i + 1]
+    if operator.type != token.EQUAL:
+        return False
+    # this is hacky but it's better than nothing...
+    rhs = children[i + 2]
+    return (
+        rhs.type == syms.power
+        and rhs.children[0].type == token.NAME
+        and rhs.children[0].value in ASSIGNMENT_TYPE_DEFS
+    )
+
+
+def get_signature(funcdef: Node) -> Tuple[str, Tuple[str, ...]]:
+    """
+    Args:
+        funcdef: `funcdef` node
+
+    Returns:
+        the name and annotatable arg names (i.e. excluding any `self`/`cls`)
+        of the function
+    """
+    name = funcdef.children[1].value
+    arg_names = _get_arg_names(funcdef)
+    if _is_method(funcdef) and not _is_staticmethod(funcdef):
+        arg_names = arg_names[1:]
+    return name, arg_names
+
 
+def collect_local_types(tree: Node) -> LocalTypes:
+    """
+    Collect the names defined or imported in a module, from the fissix parse
+    tree of the module.
+
+    We walk the tree with an explicit stack, and only look at the node types
+    we collect something from (via the `visitors` table).
+
+    TODO: we could feasibly determine visibility of non-top-level classdefs
+    and imports (currently we find defs at all levels)
+    TODO: if we don't do scopes maybe we should take top-level defs only
+    """
     type_defs = set()
     star_imports = set()
     names_to_packages = {}
     package_imports = set()
-    signatures: Signatures = {}
-    for node in walk_tree(tree):
-        if node.type == "funcdef":
-            # stash the annotatable arg names for every funcdef...
-            name = node.name.value
-            line_no = node.start_pos[0]
-            arg_names = tuple(_star_prefixed(param) for param in node.get_params())
-            if _is_method(node) and not _is_staticmethod(node):
-                arg_names = arg_names[1:]
-            assert line_no not in signatures
-            signatures[line_no] = (name, arg_names)
-        elif isinstance(node, parso.python.tree.Class):
-            type_defs.add(node.name.value)
-        elif isinstance(node, parso.python.tree.ImportFrom):
-            prefix = "." * node.level
-            package = ".".join(name.value for name in node.get_from_names())
-            if node.is_star_import():
-                star_imports.add(f"{prefix}{package}")
-            else:
-                for name in node.get_defined_names():
-                    names_to_packages[name.value] = f"{prefix}{package}"
-        elif isinstance(node, parso.python.tree.ImportName):
-            paths = node.get_paths()[0]
-            package_imports.add(".".join(path.value for path in paths))
-        elif isinstance(node, parso.python.tree.Name):
-            next_sib = node.get_next_sibling()
-            # if node is lhs of an assignment, look for ASSIGNMENT_TYPE_DEFS on rhs...
-            if next_sib and next_sib.type == "operator" and next_sib.value == "=":
-                next_sib = next_sib.get_next_sibling()
-                # this is hacky but it's better than nothing...
-                if (
-                    next_sib
-                    and next_sib.type in ("power", "atom_expr")  # 2.7 / 3.x variation
-                    and hasattr(next_sib, "children")
-                    and next_sib.children[0].type == "name"
-                    and next_sib.children[0].value in ASSIGNMENT_TYPE_DEFS
-                ):
-                    # NOTE:
-                    # in case like `T = TypeVar('V')` we will take `T` as the type name
-                    # ...I think this reflects how type-checkers will behave
-                    type_defs.add(node.value)
+
+    def visit_classdef(node: Node) -> None:
+        type_defs.add(node.children[1].value)
+
+    def visit_import_from(node: Node) -> None:
+        package = _get_import_from_module(node)
+        names = _get_import_from_names(node)
+        if names is None:
+            star_imports.add(package)
+        else:
+            for name in names:
+                names_to_packages[name] = package
+
+    def visit_import_name(node: Node) -> None:
+        package_imports.add(_get_import_name_path(node))
+
+    def visit_expr_stmt(node: Node) -> None:
+        # if a name is lhs of an assignment, look for ASSIGNMENT_TYPE_DEFS on rhs...
+        children = node.children
+        for i, child in enumerate(children):
+            if child.type == token.NAME and _is_assignment_type_def(children, i):
+                # NOTE:
+                # in case like `T = TypeVar('V')` we will take `T` as the type name
+                # ...I think this reflects how type-checkers will behave
+                type_defs.add(child.value)
+
+    visitors: Dict[int, Callable[[Node], None]] = {
+        syms.classdef: visit_classdef,
+        syms.import_from: visit_import_from,
+        syms.import_name: visit_import_name,
+        syms.expr_stmt: visit_expr_stmt,
+    }
+
+    # (we don't need to visit leaves)
+    stack: List[Node] = [tree]
+    while stack:
+        node = stack.pop()
+        visit = visitors.get(node.type)
+        if visit is not None:
+            visit(node)
+        # reversed, so that we visit in pre-order
+        for child in reversed(node.children):
+            if isinstance(child, Node):
+                stack.append(child)
 
     return LocalTypes.factory(
         type_defs=type_defs,
         star_imports=star_imports,
         names_to_packages=names_to_packages,
         package_imports=package_imports,
-        signatures=signatures,
     )
 
 
+def _parse_source(source: str, python_version: str) -> Node:
+    """
+    Parse `source` with the fissix grammar matching `python_version`,
+    falling back to the other grammar (i.e. with or without a `print`
+    statement) if that fails.
+    """
+    grammars = [pygram.python_grammar, pygram.python_grammar_no_print_statement]
+    if str(python_version).startswith("3"):
+        grammars.reverse()
+    if not source.endswith("\n"):
+        source += "\n"
+    for grammar in grammars:
+        try:
+            return driver.Driver(grammar, convert=pytree.convert).parse_string(source)
+        except ParseError as e:
+            error = e
+    raise error
+
+
+@inject.params(settings="settings")
+def find_local_types(filename: str, settings) -> LocalTypes:
+    """
+    Parse `filename` and collect its local types.
+
+    (When refactoring we already have a parse tree for the file and can use
+    `collect_local_types` directly)
+
+    NOTE: the fissix grammar does not support Python 3.8-only syntax, such as
+    assignment expressions or positional-only args, so for these files this
+    raises `ParseError` (as the refactoring itself would fail to parse them).
+
+    Raises:
+        ParseError
+    """
+    with open(filename) as f:
+        tree = _parse_source(f.read(), settings.PYTHON_VERSION)
+    return collect_local_types(tree)
+
+
 class ImportStrategist:
     _local_types: LocalTypes
 
@@ -404,22 +586,26 @@ def get_import_lines(
     return imports_dict
 
 
-def slice_by_pos(val: str, start: SourcePos, end: SourcePos) -> str:
+def slice_by_pos(
+    val: str, start: SourcePos, end: SourcePos, lines: Optional[List[str]] = None
+) -> str:
     """
     Slices the input string `val` and returns the portion between the
     `start` and `end` SourcePos markers.
+
+    `lines` can be passed if the caller has already split `val` into lines.
     """
-    if "\n" in val:
+    if lines is None:
+        if "\n" not in val:
+            return val[start.col : end.col]
         lines = val.split("\n")
-        if end.row > start.row:
-            top = lines[start.row][start.col :]
-            filling = lines[start.row + 1 : end.row]
-            bottom = lines[end.row][: end.col]
-            return "\n".join(line for line in chain([top], filling, [bottom]))
-        else:
-            return lines[start.row][start.col : end.col]
+    if end.row > start.row:
+        top = lines[start.row][start.col :]
+        filling = lines[start.row + 1 : end.row]
+        bottom = lines[end.row][: end.col]
+        return "\n".join(line for line in chain([top], filling, [bottom]))
     else:
-        return val[start.col : end.col]
+        return lines[start.row][start.col : end.col]
 
 
 class TypeDefRole(Enum):
@@ -427,22 +613,37 @@ class TypeDefRole(Enum):
     RETURN = auto()
 
 
+class _LinesEdit(NamedTuple):
+    """
+    Replace `lines[start:end]` with `replacement`
+    """
+
+    start: int
+    end: int
+    replacement: List[str]
+
+
 def _remove_type_def(
-    lines: List[str], type_def: TypeDef, offset: SourcePos, role: TypeDefRole
-) -> List[str]:
+    lines: List[str], type_def: TypeDef, role: TypeDefRole
+) -> _LinesEdit:
+    """
+    NOTE: `lines` are those of the original docstring, so the edits for all
+    the TypeDefs in a signature can be computed up front and applied in one
+    pass (they do not overlap and are in source order).
+    """
     expand = 0
     if role is TypeDefRole.ARG:
         # we can assume the TypeDef is surrounded by parentheses
         expand = 1
 
-    start_pos = type_def.start_pos + offset
+    start_pos = type_def.start_pos
     start_line = lines[start_pos.row]
     prefix = start_line[: start_pos.col - expand]
     if role is TypeDefRole.ARG:
         # remove preceding whitespace after arg name before open paren
         prefix = prefix.rstrip()
 
-    end_pos = type_def.end_pos + offset
+    end_pos = type_def.end_pos
     end_line = lines[end_pos.row]
     _end = end_pos.col + expand
     if role is TypeDefRole.RETURN:
@@ -473,16 +674,11 @@ def _remove_type_def(
             _pre -= 1
             while _pre > 0 and lines[_pre - 1].strip() == "":
                 _pre -= 1
-            segments = [lines[:_pre], lines[_post:]]
-        else:
-            if replaced_line.strip():
-                segments = [lines[:_pre], [replaced_line], lines[_post:]]
-            else:
-                segments = [lines[:_pre], lines[_post:]]
-    else:
-        segments = [lines[:_pre], [replaced_line], lines[_post:]]
+            return _LinesEdit(_pre, _post, [])
+        elif not replaced_line.strip():
+            return _LinesEdit(_pre, _post, [])
 
-    return [line for line in chain.from_iterable(segments)]
+    return _LinesEdit(_pre, _post, [replaced_line])
 
 
 def remove_types(docstring: str, signature: TypeSignature) -> str:
@@ -491,21 +687,21 @@ def remove_types(docstring: str, signature: TypeSignature) -> str:
         `docstring` with its type annotations removed
     """
     lines = docstring.split("\n")
-    original_line_count = len(lines)
-    offset = SourcePos(0, 0)
+    edits: List[_LinesEdit] = []
     if signature.arg_types:
         for type_def in signature.arg_types.args.values():
             if type_def is not None:
-                lines = _remove_type_def(
-                    lines=lines, type_def=type_def, offset=offset, role=TypeDefRole.ARG,
-                )
-                line_count = len(lines)
-                offset = SourcePos(line_count - original_line_count, 0)
+                edits.append(_remove_type_def(lines, type_def, TypeDefRole.ARG))
     if signature.return_type and signature.return_type.type_def is not None:
-        lines = _remove_type_def(
-            lines=lines,
-            type_def=signature.return_type.type_def,
-            offset=offset,
-            role=TypeDefRole.RETURN,
+        edits.append(
+            _remove_type_def(lines, signature.return_type.type_def, TypeDefRole.RETURN)
         )
-    return "\n".join(lines)
+
+    result: List[str] = []
+    row = 0
+    for edit in edits:
+        result.extend(lines[row : edit.start])
+        result.extend(edit.replacement)
+        row = edit.end
+    result.extend(lines[row:])
+    return "\n".join(result)
@@ -258,22 +258,12 @@ class TypeSignature:
         return names
 
 
-"""
-Mapping of document line-number to (name, [arg_name, ...])
-
-(for instancemethod and classmethod the non-annotatable initial
-arg has been omitted)
-"""
-Signatures = Dict[int, Tuple[str, Tuple[str, ...]]]
-
-
 @dataclass(frozen=True)
 class LocalTypes:
     type_defs: Set[str]
     star_imports: Set[str]
     names_to_packages: Dict[str, str]
     package_imports: Set[str]
-    signatures: Signatures
 
     all_names: Set[str]
 
@@ -285,7 +275,6 @@ class LocalTypes:
             names_to_packages={},
             package_imports=set(),
             all_names=set(),
-            signatures={},
         )
 
     @classmethod
@@ -295,7 +284,6 @@ class LocalTypes:
         star_imports: Set[str],
         names_to_packages: Dict[str, str],
         package_imports: Set[str],
-        signatures: Signatures,
     ) -> "LocalTypes":
         # should be no overlap in names, that would be a bug in the src file!
         assert not type_defs & names_to_packages.keys()
@@ -305,7 +293,6 @@ class LocalTypes:
             names_to_packages=names_to_packages,
             package_imports=package_imports,
             all_names=type_defs | names_to_packages.keys(),
-            signatures=signatures,
         )
 
     def __contains__(self, name) -> bool:
@@ -375,6 +362,20 @@ class UnpathedTypePolicy(Enum):
     FAIL = auto()  # don't annotate, show error
 
 
+class ValidationBackend(Enum):
+    # (values are the corresponding bowler `BowlerTool.validation` options)
+    FISSIX = "fissix"  # re-parse whole file with fissix
+    AST = "ast"  # use built-in `ast` parser (Py3 only, else as FISSIX)
+    INCREMENTAL = "incremental"  # re-parse just the modified statements
+
+
+class SchedulePolicy(Enum):
+    # (values are the corresponding bowler `BowlerTool.schedule` options)
+    DISCOVERY = "discovery"  # process files in the order they are found
+    SIZE = "size"  # largest files first
+    HISTORY = "history"  # slowest first, per durations from the cache
+
+
 class LogLevel(Enum):
     DEBUG = logging.DEBUG
     INFO = logging.INFO